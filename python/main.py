@@ -1,8 +1,38 @@
-from streamregex import StreamMatcher, SecurityPatterns
+import io
 
-matcher = StreamMatcher()
-for pattern in SecurityPatterns.OWASP_TOP_10:
-    matcher.add_pattern(pattern)
+from streamregex import StreamMatcher
+
+# Synthetic HTTP traffic with an attack every few requests, used as the
+# profile-guided optimization workload
+requests = [
+    b"GET /index.html HTTP/1.1\r\nHost: example.com\r\nUser-Agent: curl/8.0\r\n\r\n",
+    b"GET /search?q=shoes&page=2 HTTP/1.1\r\nHost: example.com\r\n\r\n",
+    b"GET /items?id=1 UNION SELECT password FROM users HTTP/1.1\r\nHost: example.com\r\n\r\n",
+    b"POST /comment HTTP/1.1\r\nHost: example.com\r\n\r\nbody=<script>alert(document.cookie)</script>",
+    b"GET /static/../../etc/passwd HTTP/1.1\r\nHost: example.com\r\n\r\n",
+    b"POST /api/query HTTP/1.1\r\nHost: example.com\r\n\r\nq=1; DROP TABLE users; --",
+]
+data = b"".join(requests) * 20_000
+
+matcher = StreamMatcher.owasp_top_10()
+# Literals are matched by the Rust automaton, the OWASP regexes by `re` only
+# where the automaton found a literal they require
+matcher.add_pattern("/etc/passwd", "passwd_access")
+matcher.add_pattern("(?i)drop table", "sql_drop")
+matcher.add_pattern("(?i)<script", "script_tag")
+
+counts = {}
+
+
+def on_match(result):
+    counts[result.pattern_id] = counts.get(result.pattern_id, 0) + 1
+
+
+matcher.add_callback(on_match)
 
 # Process streaming data
-matcher.process_chunk(data)
\ No newline at end of file
+with matcher:
+    matcher.process_stream(io.BytesIO(data))
+
+for pattern_id, count in sorted(counts.items()):
+    print(f"{pattern_id}: {count}")
@@ -0,0 +1,3 @@
+from .matcher import MatchBatch, MatchResult, SecurityPatterns, StreamHandle, StreamMatcher
+
+__all__ = ["MatchBatch", "MatchResult", "SecurityPatterns", "StreamHandle", "StreamMatcher"]
@@ -1,18 +1,189 @@
-from typing import Callable, List, Optional, Union
-from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Pattern, Tuple, Union
+import asyncio
+import re
+import re._parser as _re_parser
 import threading
-from concurrent.futures import ThreadPoolExecutor
 
-# Import the Rust module
-from .streamregex_rust import PyStreamMatcher
+import numpy as np
 
+# Import the Rust module; MatchResult is a native class with read-only
+# pattern_index, position and length attributes, and a pattern_id property
+# that looks the name up in the matcher's id table. The Rust StreamHandle is
+# an opaque handle for one logical stream.
+from . import streamregex_rust
+from .streamregex_rust import MatchResult, PyStreamMatcher
 
-@dataclass
-class MatchResult:
-    """Container for pattern match results"""
-    pattern_id: str
-    position: int
-    length: int
+# Bytes of a stream kept for the `re` fallback, so its matches may span chunk
+# boundaries; fallback matches longer than this are only found within a chunk
+_FALLBACK_OVERLAP = 4096
+
+# Shortest required literal worth handing to the automaton; shorter ones
+# occur too often to save the fallback any work
+_MIN_FACTOR_LENGTH = 3
+
+
+class MatchBatch:
+    """
+    All matches of one chunk, stored as parallel arrays.
+
+    Matches are ordered by the offset at which they end, whichever engine
+    found them, and callbacks are invoked in the same order.
+
+    Attributes:
+        positions: Stream offset of the first matched byte (int64)
+        lengths: Number of matched bytes (int32)
+        pattern_ids: Index of the matching pattern into id_table (uint32)
+        id_table: Pattern IDs in the order the patterns were added
+    """
+
+    __slots__ = ("positions", "lengths", "pattern_ids", "id_table")
+
+    def __init__(self, positions: np.ndarray, lengths: np.ndarray, pattern_ids: np.ndarray, id_table: List[str]):
+        self.positions = positions
+        self.lengths = lengths
+        self.pattern_ids = pattern_ids
+        self.id_table = id_table
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __iter__(self) -> Iterator[MatchResult]:
+        """Yield a MatchResult per match; these are only created when iterating"""
+        id_table = self.id_table
+        for position, length, index in zip(self.positions.tolist(), self.lengths.tolist(), self.pattern_ids.tolist()):
+            yield MatchResult(index, position, length, id_table)
+
+
+class StreamHandle:
+    """
+    One logical stream, as returned by StreamMatcher.open_stream.
+
+    Wraps the Rust stream state together with the last bytes of the stream,
+    which the `re` fallback patterns scan again with the next chunk.
+    """
+
+    __slots__ = ("_handle", "_lock", "_tail", "_fallback_ends", "_factor_starts")
+
+    def __init__(self, handle: streamregex_rust.StreamHandle):
+        self._handle = handle
+        # Chunks of one stream are applied one at a time
+        self._lock = threading.Lock()
+        self._tail = b""
+        # Stream offset where the next search of each fallback pattern starts
+        self._fallback_ends: Dict[int, int] = {}
+        # Stream offset of the latest required literal of each fallback pattern
+        self._factor_starts: Dict[int, int] = {}
+
+    @property
+    def bytes_processed(self) -> int:
+        """Number of bytes scanned with this stream so far"""
+        return self._handle.bytes_processed
+
+    @property
+    def closed(self) -> bool:
+        return self._handle.closed
+
+
+def _as_bytes_pattern(pattern: Pattern) -> Pattern[bytes]:
+    """Return a regex that searches bytes, recompiling str patterns if needed"""
+    if isinstance(pattern.pattern, bytes):
+        return pattern
+    # re.UNICODE is implied for str patterns and invalid for bytes patterns
+    return re.compile(pattern.pattern.encode(), pattern.flags & ~re.UNICODE)
+
+
+def _required_factors(regex: Pattern[bytes]) -> List[str]:
+    """
+    Literals one of which occurs in every match of `regex`, in the syntax
+    PyStreamMatcher.compile_patterns takes, or an empty list if it has none
+    worth searching for.
+    """
+    try:
+        parsed = _re_parser.parse(regex.pattern, regex.flags)
+    except (re.error, TypeError, ValueError):
+        return []
+
+    factors = _sequence_factors(parsed, bool(parsed.state.flags & re.IGNORECASE))
+    if not factors or min(len(literal) for literal, _ in factors) < _MIN_FACTOR_LENGTH:
+        return []
+    # A case-sensitive literal starting like the flag would be misread
+    if any(literal.startswith(b"(?i)") and not ignore_case for literal, ignore_case in factors):
+        return []
+    return [("(?i)" if ignore_case else "") + literal.decode("ascii") for literal, ignore_case in factors]
+
+
+def _sequence_factors(items, ignore_case: bool) -> Optional[List[Tuple[bytes, bool]]]:
+    """Most selective set of required literals of a parsed regex sequence"""
+    best = None
+    run = bytearray()
+    # The sentinel ends the last run of literals
+    for op, av in [*items, (None, None)]:
+        if op is _re_parser.LITERAL and av < 0x80:
+            run.append(av)
+            continue
+        if run:
+            best = _better_factors(best, [(bytes(run), ignore_case)])
+            run = bytearray()
+
+        if op is _re_parser.SUBPATTERN:
+            _, add_flags, del_flags, sub = av
+            sub_ignore_case = (ignore_case or bool(add_flags & re.IGNORECASE)) and not del_flags & re.IGNORECASE
+            candidate = _sequence_factors(sub, sub_ignore_case)
+        elif op in (_re_parser.MAX_REPEAT, _re_parser.MIN_REPEAT, _re_parser.POSSESSIVE_REPEAT) and av[0] >= 1:
+            candidate = _sequence_factors(av[2], ignore_case)
+        elif op is _re_parser.ATOMIC_GROUP:
+            candidate = _sequence_factors(av, ignore_case)
+        elif op is _re_parser.BRANCH:
+            # Every alternative must contribute a literal
+            alternatives = [_sequence_factors(branch, ignore_case) for branch in av[1]]
+            if any(alternative is None for alternative in alternatives):
+                continue
+            candidate = list(dict.fromkeys(factor for alternative in alternatives for factor in alternative))
+        else:
+            # Assertions and classes neither contribute nor break the sequence
+            continue
+        best = _better_factors(best, candidate)
+    return best
+
+
+def _better_factors(
+    first: Optional[List[Tuple[bytes, bool]]], second: Optional[List[Tuple[bytes, bool]]]
+) -> Optional[List[Tuple[bytes, bool]]]:
+    """The set whose shortest literal is longer, or with fewer literals if equal"""
+    if first is None or second is None:
+        return first or second
+
+    def score(factors):
+        return min(len(literal) for literal, _ in factors), -len(factors)
+
+    return second if score(second) > score(first) else first
+
+
+def _split_factor_hits(
+    arrays: Tuple[np.ndarray, np.ndarray, np.ndarray], fallback: List[Tuple[int, Pattern[bytes], bool]], known: int
+) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray], Dict[int, int]]:
+    """
+    Separate the required literals of gated fallback patterns, which the
+    automaton reports under the pattern's index, from the actual matches.
+
+    Results of patterns at index `known` or later are dropped. Returns the
+    matches and the latest start of a required literal per gated pattern.
+    """
+    positions, lengths, pattern_ids = arrays
+    if not len(pattern_ids):
+        return arrays, {}
+
+    gated = [index for index, _, is_gated in fallback if is_gated]
+    hints = np.isin(pattern_ids, gated)
+    dropped = hints | (pattern_ids >= known)
+    if not dropped.any():
+        return arrays, {}
+
+    factor_starts: Dict[int, int] = {}
+    for index, start in zip(pattern_ids[hints].tolist(), positions[hints].tolist()):
+        factor_starts[index] = max(start, factor_starts.get(index, start))
+    kept = ~dropped
+    return (positions[kept], lengths[kept], pattern_ids[kept]), factor_starts
 
 
 class StreamMatcher:
@@ -21,22 +192,194 @@ class StreamMatcher:
     def __init__(self):
         self._matcher = PyStreamMatcher()
         self._callbacks: List[Callable[[MatchResult], None]] = []
-        self._lock = threading.Lock()
-        self._executor = ThreadPoolExecutor(max_workers=1)
+        # Guards the pattern lists below; never held while compiling
+        self._patterns_lock = threading.Lock()
+        # Serializes compilations, so batches are registered in the order added
+        self._compile_lock = threading.Lock()
+        # Patterns waiting to be compiled as one set on the next process_chunk,
+        # as (source for Rust or None, regex, ID)
+        self._pending: List[Tuple[Optional[str], Pattern[bytes], str]] = []
+        # Number of patterns registered with Rust, and number the next scan
+        # must compile first (add_pattern_async compiles its own patterns)
+        self._compiled = 0
+        self._required = 0
+        # Patterns the Rust automaton cannot express, evaluated with `re`, as
+        # (index, regex, gated). The automaton reports where the required
+        # literals of gated patterns occur, and they are only run there.
+        self._fallback: List[Tuple[int, Pattern[bytes], bool]] = []
+        # Pattern IDs indexed by the pattern indices the Rust side reports
+        self._pattern_ids: List[str] = []
+        self._closed = False
+
+    def __enter__(self) -> "StreamMatcher":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Release the compiled pattern set.
+
+        The matcher cannot be used afterwards. Called on leaving a `with`
+        block; calling it again has no effect. A compilation still in
+        progress cannot bring the patterns back afterwards.
+        """
+        with self._patterns_lock:
+            self._closed = True
+            self._matcher.close()
+            self._fallback = []
+            self._pending.clear()
+
+    def _check_open(self):
+        if self._closed:
+            raise ValueError("StreamMatcher is closed")
+
+    @classmethod
+    def from_patterns(cls, patterns: Iterable[Union[str, Pattern]]) -> "StreamMatcher":
+        """
+        Create a matcher with a pattern set compiled up front.
+
+        Compiled pattern sets are cached by the Rust side, so further matchers
+        for the same patterns skip most of the compilation work.
+
+        Args:
+            patterns: The patterns to match; IDs are auto-generated
+
+        Returns:
+            A matcher ready to process data
+        """
+        matcher = cls()
+        for pattern in patterns:
+            matcher.add_pattern(pattern)
+        matcher._compile_pending()
+        return matcher
+
+    @classmethod
+    def owasp_top_10(cls) -> "StreamMatcher":
+        """
+        Create a matcher for SecurityPatterns.OWASP_TOP_10.
+
+        The regexes are compiled once at import and shared by every matcher
+        created here, and matches are reported under descriptive IDs such as
+        "sql_injection".
+
+        Returns:
+            A matcher ready to process data
+        """
+        matcher = cls()
+        for pattern, pattern_id in zip(SecurityPatterns.OWASP_TOP_10_COMPILED, SecurityPatterns.OWASP_TOP_10_IDS):
+            matcher.add_pattern(pattern, pattern_id)
+        matcher._compile_pending()
+        return matcher
 
-    def add_pattern(self, pattern: str, pattern_id: Optional[str] = None) -> str:
+    def add_pattern(self, pattern: Union[str, Pattern], pattern_id: Optional[str] = None) -> str:
         """
         Add a pattern to the matcher.
 
+        Compilation is deferred until the next chunk is processed, so that all
+        patterns added in between are compiled together. Precompiled regular
+        expressions are used as they are and always evaluated with `re`.
+
         Args:
-            pattern: The pattern to match
+            pattern: The pattern to match, as a string or a compiled regex
             pattern_id: Optional identifier for the pattern
 
         Returns:
             The pattern ID (either provided or auto-generated)
         """
-        with self._lock:
-            return self._matcher.add_pattern(pattern, pattern_id)
+        return self._add_pattern(pattern, pattern_id, compile_on_scan=True)
+
+    def _add_pattern(self, pattern: Union[str, Pattern], pattern_id: Optional[str], compile_on_scan: bool) -> str:
+        """Queue a pattern for compilation; see add_pattern"""
+        # Invalid regexes are rejected here, before anything is registered
+        if isinstance(pattern, re.Pattern):
+            source, regex = None, _as_bytes_pattern(pattern)
+        elif isinstance(pattern, str):
+            source, regex = pattern, re.compile(pattern.encode())
+        else:
+            raise TypeError("Pattern must be a string or a compiled regular expression")
+
+        with self._patterns_lock:
+            self._check_open()
+            if pattern_id is None:
+                pattern_id = f"pattern_{len(self._pattern_ids)}"
+            self._pattern_ids.append(pattern_id)
+            self._pending.append((source, regex, pattern_id))
+            if compile_on_scan:
+                self._required = len(self._pattern_ids)
+            return pattern_id
+
+    async def add_pattern_async(self, pattern: Union[str, Pattern], pattern_id: Optional[str] = None) -> str:
+        """
+        Add a pattern and compile it in a worker thread.
+
+        The pattern set is compiled without blocking the event loop, and scans
+        running meanwhile keep using the previous set until the new one is
+        swapped in without waiting for it. Once this returns, the pattern is live.
+
+        Args:
+            pattern: The pattern to match, as a string or a compiled regex
+            pattern_id: Optional identifier for the pattern
+
+        Returns:
+            The pattern ID (either provided or auto-generated)
+        """
+        pattern_id = self._add_pattern(pattern, pattern_id, compile_on_scan=False)
+        await asyncio.to_thread(self._compile_pending)
+        return pattern_id
+
+    def _compile_pending(self):
+        """
+        Compile all pending patterns in one batch, after any compilation in progress.
+
+        The patterns lock is only held to take the batch and to publish the
+        result, so scans and add_pattern calls are not held up meanwhile.
+        Either the whole batch is registered or, if the Rust side rejects it,
+        none of it is and the error is raised.
+        """
+        with self._compile_lock:
+            with self._patterns_lock:
+                if self._closed or not self._pending:
+                    return
+                batch, self._pending = self._pending, []
+                first_index = self._compiled
+
+            sources, regexes, pattern_ids = zip(*batch)
+            factors = [_required_factors(regex) for regex in regexes]
+            try:
+                # Compiled regexes are not sent to Rust, only their IDs and
+                # required literals
+                unsupported = self._matcher.compile_patterns(list(sources), list(pattern_ids), factors)
+            except Exception:
+                with self._patterns_lock:
+                    del self._pattern_ids[first_index:first_index + len(batch)]
+                    self._required = max(first_index, self._required - len(batch))
+                raise
+
+            with self._patterns_lock:
+                if not self._closed:
+                    # Replaced rather than appended to, so concurrent scans see a stable list
+                    self._fallback = self._fallback + [
+                        (first_index + index, regexes[index], bool(factors[index])) for index in unsupported
+                    ]
+                # Published last: scans that see the new count see its fallback too
+                self._compiled = first_index + len(batch)
+
+    def pattern_id_to_name(self, index: int) -> str:
+        """
+        Look up the ID of a pattern by its index.
+
+        Matches carry the index of their pattern (MatchResult.pattern_index and
+        MatchBatch.pattern_ids); the ID string is only needed for display.
+
+        Args:
+            index: Pattern index, in the order patterns were added
+
+        Returns:
+            The pattern ID
+        """
+        return self._pattern_ids[index]
 
     def add_callback(self, callback: Callable[[MatchResult], None]):
         """
@@ -45,58 +388,319 @@ class StreamMatcher:
         Args:
             callback: Function to call with MatchResult when patterns are found
         """
+        if not callable(callback):
+            raise TypeError("Callback must be callable")
         self._callbacks.append(callback)
 
-    def process_chunk(self, data: Union[bytes, bytearray, memoryview]):
+    def open_stream(self) -> StreamHandle:
+        """
+        Start a new logical stream.
+
+        Chunks passed to process_chunk with the returned handle are scanned as
+        one continuous stream, so matches may span chunk boundaries. Streams
+        are independent of each other and of the threads using them.
+
+        Returns:
+            The handle to pass to process_chunk and close_stream
+        """
+        return StreamHandle(self._matcher.open_stream())
+
+    def close_stream(self, stream: StreamHandle) -> int:
         """
-        Process a chunk of streaming data.
+        Close a stream opened with open_stream.
+
+        Matches of `re` fallback patterns that reach the end of the stream are
+        only final now, so they are passed to the callbacks here.
 
         Args:
-            data: Bytes-like object containing the data to process
+            stream: The stream to close
+
+        Returns:
+            The number of bytes scanned with the stream
         """
-        if not isinstance(data, (bytes, bytearray, memoryview)):
-            raise TypeError("Data must be bytes, bytearray, or memoryview")
+        with stream._lock:
+            found = self._flush_fallback_stream(stream) if stream._tail else []
+            stream._tail = b""
+            bytes_processed = self._matcher.close_stream(stream._handle)
+
+        if found:
+            empty = np.empty(0, dtype=np.int64)
+            self._deliver(empty, empty.astype(np.int32), empty.astype(np.uint32), found)
+        return bytes_processed
+
+    def process_chunk(
+        self, data: Union[bytes, bytearray, memoryview], stream: Optional[StreamHandle] = None
+    ) -> MatchBatch:
+        """
+        Process a chunk of data.
+
+        Without a stream the chunk is scanned on its own: match positions are
+        relative to the start of the chunk and matches spanning chunk
+        boundaries are not found. With a stream from open_stream, the chunk
+        continues that stream and positions are offsets into it; matches of
+        patterns evaluated with `re` may span chunks only if they start within
+        the last 4096 bytes before the chunk, and those reaching the end of
+        the chunk are held back until more data or close_stream decides them.
+        Chunks from several threads are scanned in parallel.
 
-        with self._lock:
-            self._matcher.process_chunk(bytes(data))
+        Contiguous buffers are scanned in place with the GIL released, so a
+        writable buffer (bytearray, NumPy array, mmap) must not be modified by
+        another thread until this returns; the result of doing so is undefined.
+
+        Args:
+            data: Any object supporting the buffer protocol; its raw bytes are scanned
+            stream: Optional stream the chunk belongs to
+
+        Returns:
+            The matches found in the chunk
+        """
+        try:
+            view = memoryview(data)
+        except TypeError:
+            raise TypeError("Data must be a bytes-like object") from None
+
+        # The Rust side reads the buffer in place as unsigned bytes; any
+        # contiguous buffer (mmap, NumPy arrays, array.array) is reinterpreted
+        # without copying, only strided views are copied
+        if not view.c_contiguous:
+            view = memoryview(view.tobytes())
+        elif view.format != "B" or view.ndim != 1:
+            view = view.cast("B")
+
+        self._check_open()
+        if self._compiled < self._required:
+            # Patterns from add_pattern are live for the next chunk; those
+            # still compiling for add_pattern_async are not waited for
+            self._compile_pending()
+
+        # Read before scanning, so Rust scans with at least these patterns;
+        # results of any registered since are left out of this chunk
+        known = self._compiled
+        fallback = [entry for entry in self._fallback if entry[0] < known]
+
+        # All matches of the chunk come back from Rust as three arrays; the
+        # GIL is released while scanning
+        if stream is not None:
+            with stream._lock:
+                offset, arrays = self._matcher.process_stream_chunk_buffer(stream._handle, view)
+                (positions, lengths, pattern_ids), factor_starts = _split_factor_hits(arrays, fallback, known)
+                for index, start in factor_starts.items():
+                    stream._factor_starts[index] = max(start, stream._factor_starts.get(index, start))
+                found = self._scan_fallback_stream(stream, view, offset, fallback)
+        else:
+            arrays = self._matcher.process_chunk_buffer(view)
+            (positions, lengths, pattern_ids), factor_starts = _split_factor_hits(arrays, fallback, known)
+            found = [
+                (match.start(), match.end() - match.start(), index)
+                for index, regex, gated in fallback
+                if not gated or index in factor_starts
+                for match in regex.finditer(view)
+            ]
+        return self._deliver(positions, lengths, pattern_ids, found)
+
+    def _deliver(
+        self,
+        positions: np.ndarray,
+        lengths: np.ndarray,
+        pattern_ids: np.ndarray,
+        fallback: List[Tuple[int, int, int]],
+    ) -> MatchBatch:
+        """Merge the Rust and fallback matches into a batch and pass it to the callbacks"""
+        if fallback:
+            extra_positions, extra_lengths, extra_ids = zip(*fallback)
+            positions = np.concatenate([positions, np.array(extra_positions, dtype=np.int64)])
+            lengths = np.concatenate([lengths, np.array(extra_lengths, dtype=np.int32)])
+            pattern_ids = np.concatenate([pattern_ids, np.array(extra_ids, dtype=np.uint32)])
+            # Fallback matches are grouped by pattern, so order the whole
+            # batch by end; the stable sort keeps ties in the order found.
+            # Without fallback matches the Rust part is in end order already.
+            order = np.argsort(positions + lengths, kind="stable")
+            positions, lengths, pattern_ids = positions[order], lengths[order], pattern_ids[order]
+
+        batch = MatchBatch(positions, lengths, pattern_ids, self._pattern_ids)
+        if self._callbacks and len(batch):
+            for result in batch:
+                for callback in self._callbacks:
+                    callback(result)
+        return batch
+
+    def _scan_fallback_stream(
+        self,
+        stream: StreamHandle,
+        view: memoryview,
+        offset: int,
+        fallback: List[Tuple[int, Pattern[bytes], bool]],
+    ) -> List[Tuple[int, int, int]]:
+        """
+        Run the fallback patterns over the next chunk of a stream.
+
+        Gives the matches of re.finditer over the whole stream, provided that
+        a match starting before the chunk starts within its last
+        _FALLBACK_OVERLAP bytes and, if the chunk is longer than that, ends
+        within the chunk's first _FALLBACK_OVERLAP bytes. A match reaching the
+        end of the data so far may still change with more data (a trailing
+        \\b, a greedy quantifier), so it is left to the next chunk or to
+        close_stream. Gated patterns are skipped unless one of their required
+        literals occurs where a match could still start. Caller must hold the
+        stream's lock.
+        """
+        if not fallback:
+            return []
+
+        tail = stream._tail
+        # Matches starting in the tail, or at the first byte of the chunk where
+        # \b needs the byte before it, are searched in a window of the tail
+        # and the head of the chunk; only that much of the chunk is copied
+        head = view[:_FALLBACK_OVERLAP]
+        complete = len(head) == len(view)
+        window = None
+        window_offset = offset - len(tail)
+        found = []
+        for index, regex, gated in fallback:
+            resume = stream._fallback_ends.get(index, 0)
+            if gated and stream._factor_starts.get(index, -1) < max(resume, window_offset):
+                continue
+            if tail and window is None:
+                window = tail + head
+
+            deferred = False
+            if tail:
+                # The first byte of the window lacks the byte before it; it
+                # was searched with the previous chunk
+                for match in regex.finditer(window, max(resume - window_offset, 1 if window_offset else 0)):
+                    if not complete and match.start() > len(tail):
+                        break
+                    if match.end() == len(window):
+                        if complete:
+                            deferred = True
+                        elif match.start() == len(tail):
+                            # Starts the chunk; the window only decided that
+                            # it starts here, the chunk decides where it ends
+                            match = regex.match(view)
+                            if match and match.end() < len(view):
+                                found.append((offset, match.end(), index))
+                                resume = offset + max(match.end(), 1)
+                            elif match:
+                                # Spans the whole chunk, too long to report
+                                deferred = True
+                                resume = offset + len(view)
+                            else:
+                                resume = max(resume, offset + 1)
+                        else:
+                            # Reaches too far into the chunk to be decided
+                            resume = max(resume, offset + 1)
+                        break
+                    found.append((window_offset + match.start(), match.end() - match.start(), index))
+                    # An empty match does not end the search at its position
+                    resume = window_offset + max(match.end(), match.start() + 1)
+
+            # The rest of the chunk is searched in place
+            if not deferred and (not tail or not complete):
+                for match in regex.finditer(view, max(0, resume - offset, 1 if tail else 0)):
+                    if match.end() == len(view):
+                        break
+                    found.append((offset + match.start(), match.end() - match.start(), index))
+                    resume = offset + max(match.end(), match.start() + 1)
+
+            stream._fallback_ends[index] = resume
+
+        if tail and complete:
+            stream._tail = (window or tail + head)[-_FALLBACK_OVERLAP:]
+        else:
+            stream._tail = bytes(view[-_FALLBACK_OVERLAP:])
+        return found
+
+    def _flush_fallback_stream(self, stream: StreamHandle) -> List[Tuple[int, int, int]]:
+        """
+        Report the fallback matches left for the end of a stream, now that no
+        more data can change them. Caller must hold the stream's lock.
+        """
+        tail = stream._tail
+        tail_offset = stream.bytes_processed - len(tail)
+        found = []
+        for index, regex, gated in self._fallback:
+            resume = stream._fallback_ends.get(index, 0)
+            if gated and stream._factor_starts.get(index, -1) < max(resume, tail_offset):
+                continue
+            # Every match ending before the end of the tail was decided already
+            for match in regex.finditer(tail, max(0, resume - tail_offset, 1 if tail_offset else 0)):
+                found.append((tail_offset + match.start(), match.end() - match.start(), index))
+        return found
 
     def process_stream(self, stream, chunk_size: int = 64 * 1024):
         """
         Process a stream of data in chunks.
 
+        The stream is scanned as one logical stream, so matches may span chunk
+        boundaries and positions are offsets into the whole stream. Streams
+        that support readinto() are read into a single reusable buffer,
+        so no per-chunk bytes objects are allocated.
+
         Args:
-            stream: File-like object supporting read()
+            stream: File-like object supporting readinto() or read()
             chunk_size: Size of chunks to read and process
         """
-        while True:
-            chunk = stream.read(chunk_size)
-            if not chunk:
-                break
-            self.process_chunk(chunk)
+        handle = self.open_stream()
+        try:
+            readinto = getattr(stream, "readinto", None)
+            if readinto is None:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    self.process_chunk(chunk, handle)
+                return
 
-    async def process_stream_async(self, stream, chunk_size: int = 64 * 1024):
+            view = memoryview(bytearray(chunk_size))
+            while n := readinto(view):
+                self.process_chunk(view[:n], handle)
+        finally:
+            self.close_stream(handle)
+
+    async def process_stream_async(self, stream, chunk_size: int = 64 * 1024, max_pending: int = 4):
         """
         Process a stream asynchronously.
 
+        Like process_stream, the stream is scanned as one logical stream.
+        Chunks are scanned in a worker thread with the GIL released, so reading
+        the next chunk overlaps with scanning the previous one. At most
+        `max_pending` chunks are buffered before reading waits for the scanner
+        to catch up. Callbacks therefore run in that worker thread rather than
+        in the event loop, one chunk at a time; use loop.call_soon_threadsafe
+        to hand matches back to the loop.
+
         Args:
             stream: AsyncIO stream supporting read()
             chunk_size: Size of chunks to read and process
+            max_pending: Number of chunks that may be read ahead of the scanner
         """
-        while True:
-            chunk = await stream.read(chunk_size)
-            if not chunk:
-                break
-            await self._executor.submit(self.process_chunk, chunk)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+
+        async def read():
+            try:
+                while chunk := await stream.read(chunk_size):
+                    await queue.put(chunk)
+            finally:
+                # Wake the scanner unless it is the one that gave up on us
+                if not asyncio.current_task().cancelling():
+                    await queue.put(None)
+
+        handle = self.open_stream()
+        reader = asyncio.create_task(read())
+        try:
+            while (chunk := await queue.get()) is not None:
+                await asyncio.to_thread(self.process_chunk, chunk, handle)
+        except BaseException:
+            reader.cancel()
+            raise
+        finally:
+            self.close_stream(handle)
+        await reader
 
     def memory_usage(self) -> int:
         """Get current memory usage in bytes"""
         return self._matcher.memory_usage()
 
-    def __del__(self):
-        """Clean up resources"""
-        if self._executor:
-            self._executor.shutdown()
-
 
 # Example security pattern sets
 class SecurityPatterns:
@@ -107,4 +711,14 @@ class SecurityPatterns:
         r"(?i)(?:<script[^>]*>[\s\S]*?</script>)",  # XSS
         r"(?i)(?:\.\./|\%2e\%2e\%2f)",  # Path Traversal
         # ... (rest of the patterns)
-    ]
\ No newline at end of file
+    ]
+
+    # Pattern IDs used by StreamMatcher.owasp_top_10(), in the same order
+    OWASP_TOP_10_IDS = (
+        "sql_injection",
+        "xss",
+        "path_traversal",
+    )
+
+    # Compiled once at import, so matchers built from it skip parsing the patterns
+    OWASP_TOP_10_COMPILED = tuple(re.compile(pattern.encode()) for pattern in OWASP_TOP_10)
\ No newline at end of file
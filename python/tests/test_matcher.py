@@ -1,7 +1,10 @@
 import unittest
-import asyncio
+import array
 import io
+import re
+import numpy as np
 from streamregex import StreamMatcher, SecurityPatterns
+from streamregex.matcher import _required_factors
 from concurrent.futures import ThreadPoolExecutor
 import threading
 import time
@@ -9,7 +12,7 @@ import time
 
 class TestStreamMatcher(unittest.TestCase):
     def setUp(self):
-        self.matcher = StreamMatcher()
+        self.matcher = self.enterContext(StreamMatcher())
 
     def test_basic_matching(self):
         matches = []
@@ -24,15 +27,34 @@ class TestStreamMatcher(unittest.TestCase):
         self.assertEqual(len(matches), 1)
         self.assertEqual(matches[0].pattern_id, pattern_id)
 
+    def test_buffer_protocol_input(self):
+        matches = []
+
+        def on_match(result):
+            matches.append(result)
+
+        self.matcher.add_pattern("test")
+        self.matcher.add_callback(on_match)
+
+        data = bytearray(b"xxxx this is a test string")
+        self.matcher.process_chunk(memoryview(data)[5:])
+        # Strided views are not contiguous and take the copying path
+        self.matcher.process_chunk(memoryview(b"tteesstt")[::2])
+        # Buffers of any element type are scanned as their raw bytes
+        self.matcher.process_chunk(np.frombuffer(b"a test!!", dtype=np.uint16).reshape(2, 2))
+        self.matcher.process_chunk(array.array("H", b"xxtestxx"))
+
+        self.assertEqual(len(matches), 4)
+
     def test_security_patterns(self):
         matches = []
 
         def on_match(result):
             matches.append(result)
 
-        # Add OWASP patterns
-        for pattern in SecurityPatterns.OWASP_TOP_10:
-            self.matcher.add_pattern(pattern)
+        # Add OWASP patterns under their descriptive IDs
+        for pattern, pattern_id in zip(SecurityPatterns.OWASP_TOP_10, SecurityPatterns.OWASP_TOP_10_IDS):
+            self.matcher.add_pattern(pattern, pattern_id)
 
         self.matcher.add_callback(on_match)
 
@@ -44,6 +66,101 @@ class TestStreamMatcher(unittest.TestCase):
         self.matcher.process_chunk(b'<script>alert("xss")</script>')
         self.assertTrue(any("xss" in m.pattern_id for m in matches))
 
+    def test_owasp_top_10(self):
+        with StreamMatcher.owasp_top_10() as matcher:
+            batch = matcher.process_chunk(b"id=1 UNION SELECT password; ../../etc/passwd")
+
+        self.assertEqual(sorted(m.pattern_id for m in batch), ["path_traversal", "path_traversal", "sql_injection"])
+
+    def test_regex_fallback(self):
+        matches = []
+
+        def on_match(result):
+            matches.append(result)
+
+        literal_id = self.matcher.add_pattern("needle")
+        regex_id = self.matcher.add_pattern(r"ab+c")
+        self.matcher.add_callback(on_match)
+        self.matcher.process_chunk(b"xxabbbcxx needle")
+
+        # Fallback matches are merged into the batch in the order they end
+        self.assertEqual([m.pattern_id for m in matches], [regex_id, literal_id])
+        regex_match = next(m for m in matches if m.pattern_id == regex_id)
+        self.assertEqual((regex_match.position, regex_match.length), (2, 5))
+
+    def test_invalid_regex(self):
+        with self.assertRaises(re.error):
+            self.matcher.add_pattern("(unclosed")
+
+        # The rejected pattern leaves no trace, so later indices stay aligned
+        pattern_id = self.matcher.add_pattern("needle")
+        batch = self.matcher.process_chunk(b"hay needle")
+
+        self.assertEqual(pattern_id, "pattern_0")
+        self.assertEqual([m.pattern_id for m in batch], [pattern_id])
+
+    def test_ignore_case_literal(self):
+        self.matcher.add_pattern("(?i)needle")
+
+        batch = self.matcher.process_chunk(b"hay NeEdLe needle")
+
+        self.assertEqual(batch.positions.tolist(), [4, 11])
+
+    def test_compiled_patterns(self):
+        literal_id = self.matcher.add_pattern(re.compile("needle", re.IGNORECASE))
+        bytes_id = self.matcher.add_pattern(SecurityPatterns.OWASP_TOP_10_COMPILED[0])
+
+        batch = self.matcher.process_chunk(b"NEEDLE 1 union select 2")
+
+        self.assertEqual(sorted(m.pattern_id for m in batch), sorted([literal_id, bytes_id]))
+
+        with self.assertRaises(TypeError):
+            self.matcher.add_pattern(b"needle")
+
+    def test_match_batch(self):
+        first_id = self.matcher.add_pattern("test")
+        second_id = self.matcher.add_pattern("string")
+
+        batch = self.matcher.process_chunk(b"this is a test string")
+
+        self.assertEqual(len(batch), 2)
+        self.assertEqual(batch.positions.tolist(), [10, 15])
+        self.assertEqual(batch.lengths.tolist(), [4, 6])
+        self.assertEqual([batch.id_table[i] for i in batch.pattern_ids], [first_id, second_id])
+        self.assertEqual([m.pattern_id for m in batch], [first_id, second_id])
+        self.assertEqual([m.pattern_index for m in batch], [0, 1])
+        self.assertEqual(self.matcher.pattern_id_to_name(1), second_id)
+
+    def test_from_patterns(self):
+        for _ in range(2):
+            # The second matcher reuses the cached compiled pattern set
+            with StreamMatcher.from_patterns(["test", "string"]) as matcher:
+                batch = matcher.process_chunk(b"this is a test string")
+                self.assertEqual([m.pattern_id for m in batch], ["pattern_0", "pattern_1"])
+
+    def test_chunks_are_independent(self):
+        self.matcher.add_pattern("needle")
+
+        self.assertEqual(len(self.matcher.process_chunk(b"hay nee")), 0)
+        self.assertEqual(len(self.matcher.process_chunk(b"dle")), 0)
+
+        batch = self.matcher.process_chunk(b"hay needle")
+        self.assertEqual(batch.positions.tolist(), [4])
+
+    def test_open_stream(self):
+        self.matcher.add_pattern("needle")
+        first = self.matcher.open_stream()
+        second = self.matcher.open_stream()
+
+        self.assertEqual(len(self.matcher.process_chunk(b"hay nee", first)), 0)
+        self.assertEqual(len(self.matcher.process_chunk(b"dle", second)), 0)
+        batch = self.matcher.process_chunk(b"dle", first)
+
+        self.assertEqual(batch.positions.tolist(), [4])
+        self.assertEqual(self.matcher.close_stream(first), 10)
+        with self.assertRaises(ValueError):
+            self.matcher.process_chunk(b"needle", first)
+
     def test_stream_processing(self):
         matches = []
 
@@ -60,33 +177,95 @@ class TestStreamMatcher(unittest.TestCase):
         self.assertEqual(len(matches), 1)
         self.assertEqual(matches[0].pattern_id, pattern_id)
 
-    async def test_async_stream_processing(self):
+    def test_regex_fallback_across_chunks(self):
+        data = b"x" * 60 + b"<script>alert(1)</script> ../ <script>x</script>"
+
+        with StreamMatcher.owasp_top_10() as matcher:
+            matches = []
+            matcher.add_callback(matches.append)
+            matcher.process_stream(io.BytesIO(data), chunk_size=16)
+
+        self.assertEqual(
+            [(m.pattern_id, m.position, m.length) for m in matches],
+            [("xss", 60, 25), ("path_traversal", 86, 3), ("xss", 90, 18)],
+        )
+
+    def test_regex_fallback_matches_whole_stream(self):
+        data = b"UNION ALL SELECTx union select 1 <script>a</script> abbbb ../%2e%2e%2f ab UNION SELECT"
+        regexes = SecurityPatterns.OWASP_TOP_10_COMPILED + (re.compile(rb"ab+"),)
+        expected = sorted(
+            (pattern_id, match.start(), match.end() - match.start())
+            for pattern_id, regex in zip(SecurityPatterns.OWASP_TOP_10_IDS + ("ab",), regexes)
+            for match in regex.finditer(data)
+        )
+
+        with StreamMatcher.owasp_top_10() as matcher:
+            matcher.add_pattern(r"ab+", "ab")
+            matches = []
+            matcher.add_callback(matches.append)
+            for chunk_size in (1, 2, 3, 7, 16, len(data)):
+                matches.clear()
+                matcher.process_stream(io.BytesIO(data), chunk_size=chunk_size)
+                # Matches ending the stream are reported by close_stream
+                self.assertEqual(sorted((m.pattern_id, m.position, m.length) for m in matches), expected)
+
+    def test_required_factors(self):
+        self.assertEqual(
+            [_required_factors(regex) for regex in SecurityPatterns.OWASP_TOP_10_COMPILED],
+            [["(?i)select"], ["(?i)</script>"], ["(?i)../", "(?i)%2e%2e%2f"]],
+        )
+        # Optional parts and short literals give nothing to gate on
+        self.assertEqual(_required_factors(re.compile(rb"(abc)*x")), [])
+        self.assertEqual(_required_factors(re.compile(rb"ab+")), [])
+
+    def test_gated_regex_fallback(self):
+        pattern_id = self.matcher.add_pattern(r"needle\d+")
+
+        # The required literal alone is not reported as a match
+        self.assertEqual(len(self.matcher.process_chunk(b"hay needle x")), 0)
+        batch = self.matcher.process_chunk(b"hay needle42 x")
+        self.assertEqual([(m.pattern_id, m.position, m.length) for m in batch], [(pattern_id, 4, 8)])
+
+        stream = self.matcher.open_stream()
+        self.assertEqual(len(self.matcher.process_chunk(b"hay nee", stream)), 0)
+        batch = self.matcher.process_chunk(b"dle42 x", stream)
+        self.assertEqual([(m.position, m.length) for m in batch], [(4, 8)])
+        self.matcher.close_stream(stream)
+
+    def test_stream_processing_without_readinto(self):
         matches = []
 
         def on_match(result):
             matches.append(result)
 
-        pattern_id = self.matcher.add_pattern("async")
+        self.matcher.add_pattern("stream")
         self.matcher.add_callback(on_match)
 
-        # Simulate async stream
-        class AsyncStream:
+        class ReadOnlyStream:
             def __init__(self, data):
-                self.data = data
-                self.position = 0
+                self.stream = io.BytesIO(data)
 
-            async def read(self, size):
-                if self.position >= len(self.data):
-                    return b""
-                chunk = self.data[self.position:self.position + size]
-                self.position += size
-                return chunk
+            def read(self, size):
+                return self.stream.read(size)
 
-        stream = AsyncStream(b"testing async stream processing")
-        await self.matcher.process_stream_async(stream)
+        self.matcher.process_stream(ReadOnlyStream(b"testing stream processing"), chunk_size=4)
 
         self.assertEqual(len(matches), 1)
-        self.assertEqual(matches[0].pattern_id, pattern_id)
+        self.assertEqual(matches[0].position, 8)
+
+    def test_scans_skip_async_compile(self):
+        self.matcher.add_pattern("needle")
+        self.matcher.process_chunk(b"")
+
+        # While a compilation holds the lock, scans keep using the current set
+        with self.matcher._compile_lock:
+            self.matcher._add_pattern("other", None, compile_on_scan=False)
+            batch = self.matcher.process_chunk(b"needle other")
+        self.assertEqual(batch.positions.tolist(), [0])
+
+        self.matcher._compile_pending()
+        batch = self.matcher.process_chunk(b"needle other")
+        self.assertEqual(batch.positions.tolist(), [0, 7])
 
     def test_concurrent_processing(self):
         pattern_id = self.matcher.add_pattern("concurrent")
@@ -129,6 +308,17 @@ class TestStreamMatcher(unittest.TestCase):
             # Allow for some small variance
             self.assertLess(abs(current_usage - initial_usage), 1024 * 10)
 
+    def test_close(self):
+        with StreamMatcher() as matcher:
+            matcher.add_pattern("test")
+            self.assertEqual(len(matcher.process_chunk(b"test")), 1)
+
+        with self.assertRaises(ValueError):
+            matcher.process_chunk(b"test")
+        with self.assertRaises(ValueError):
+            matcher.add_pattern("test")
+        matcher.close()
+
     def test_error_handling(self):
         # Invalid pattern type
         with self.assertRaises(TypeError):
@@ -139,5 +329,45 @@ class TestStreamMatcher(unittest.TestCase):
             self.matcher.add_callback("not a function")
 
 
+class TestStreamMatcherAsync(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.matcher = self.enterContext(StreamMatcher())
+
+    async def test_async_stream_processing(self):
+        matches = []
+
+        def on_match(result):
+            matches.append(result)
+
+        pattern_id = self.matcher.add_pattern("async")
+        self.matcher.add_callback(on_match)
+
+        # Simulate async stream
+        class AsyncStream:
+            def __init__(self, data):
+                self.data = data
+                self.position = 0
+
+            async def read(self, size):
+                if self.position >= len(self.data):
+                    return b""
+                chunk = self.data[self.position:self.position + size]
+                self.position += size
+                return chunk
+
+        stream = AsyncStream(b"testing async stream processing")
+        await self.matcher.process_stream_async(stream)
+
+        self.assertEqual(len(matches), 1)
+        self.assertEqual(matches[0].pattern_id, pattern_id)
+
+    async def test_add_pattern_async(self):
+        pattern_id = await self.matcher.add_pattern_async("needle")
+        self.assertFalse(self.matcher._pending)
+
+        batch = self.matcher.process_chunk(b"hay needle")
+        self.assertEqual([m.pattern_id for m in batch], [pattern_id])
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,294 @@
+use std::collections::{HashMap, VecDeque};
+use std::sync::Arc;
+use parking_lot::Mutex;
+use crate::error::Error;
+use crate::pattern::Pattern;
+use crate::prefilter::Prefilter;
+
+/// Upper bound on combined states before we give up and scan pattern by pattern
+pub(crate) const MAX_STATES: usize = 1 << 16;
+
+/// Total bytes of compiled pattern sets kept for reuse by later matchers
+pub(crate) const CACHE_BUDGET: usize = 64 << 20;
+
+// A pattern set's key and its database, or the reason it needs too many
+// states, so sets that failed once are not compiled again only to fail
+type CacheEntry = (Vec<u32>, Result<Arc<Database>, String>);
+
+// Most recently used entry last
+static CACHE: Mutex<Vec<CacheEntry>> = parking_lot::const_mutex(Vec::new());
+
+// A single automaton that advances every pattern at once.
+//
+// Each combined state stands for the set of (pattern, state) pairs reached
+// by some suffix of the input, so a byte costs one table lookup no matter how
+// many patterns are loaded. Every pattern's initial state is implicitly in
+// the set: a match can begin at any byte, including one that ended a failed
+// partial match, which gives the same results as Aho-Corasick failure links.
+#[derive(Debug, Clone)]
+pub(crate) struct Database {
+    transitions: Vec<[u32; 256]>,
+    // (pattern index, match length) for every pattern that is final in a state
+    matches: Vec<Vec<(u32, u32)>>,
+    // Finds the next byte that leaves the start state
+    prefilter: Option<Prefilter>,
+}
+
+impl Database {
+    pub(crate) const START: u32 = 0;
+
+    pub(crate) fn compile(patterns: &[Pattern]) -> Result<Self, Error> {
+        let depths: Vec<Vec<usize>> = patterns.iter().map(state_depths).collect();
+
+        // Pairs every byte reaches from the initial states, shared by all sets
+        let mut from_initial: Vec<Vec<(u32, u32)>> = vec![Vec::new(); 256];
+        for (index, pattern) in patterns.iter().enumerate() {
+            for (&byte, &next) in &pattern.states[pattern.initial_state].transitions {
+                from_initial[byte as usize].push((index as u32, next as u32));
+            }
+        }
+
+        let start: Vec<(u32, u32)> = Vec::new();
+        let mut ids = HashMap::new();
+        let mut queue = VecDeque::new();
+        ids.insert(start.clone(), Self::START);
+        queue.push_back(start);
+
+        let mut transitions = Vec::new();
+        let mut matches = Vec::new();
+
+        while let Some(active) = queue.pop_front() {
+            let mut found: Vec<(u32, u32)> = active
+                .iter()
+                .filter(|&&(pattern, state)| patterns[pattern as usize].states[state as usize].is_final)
+                .map(|&(pattern, state)| (pattern, depths[pattern as usize][state as usize] as u32))
+                .collect();
+            found.sort_unstable();
+            found.dedup();
+            matches.push(found);
+
+            let mut row = [Self::START; 256];
+            for byte in 0..=255u8 {
+                // Advance every partial match that accepts the byte and start
+                // new ones; partial matches without a transition are dropped
+                let mut next = from_initial[byte as usize].clone();
+                next.extend(active.iter().filter_map(|&(pattern, state)| {
+                    let next_state = patterns[pattern as usize].states[state as usize].transitions.get(&byte)?;
+                    Some((pattern, *next_state as u32))
+                }));
+                next.sort_unstable();
+                next.dedup();
+
+                row[byte as usize] = match ids.get(&next) {
+                    Some(&id) => id,
+                    None => {
+                        if ids.len() >= MAX_STATES {
+                            return Err(Error::PatternTooComplex(format!(
+                                "{} patterns need more than {} combined states",
+                                patterns.len(),
+                                MAX_STATES
+                            )));
+                        }
+                        let id = ids.len() as u32;
+                        ids.insert(next.clone(), id);
+                        queue.push_back(next);
+                        id
+                    }
+                };
+            }
+            transitions.push(row);
+        }
+
+        let prefilter = Prefilter::new(
+            (0..=255u8).filter(|&byte| transitions[Self::START as usize][byte as usize] != Self::START),
+        );
+
+        Ok(Database { transitions, matches, prefilter })
+    }
+
+    /// Like `compile`, but reuses the database, or the error, of an
+    /// identical pattern set compiled earlier in this process.
+    ///
+    /// The cache holds at most `CACHE_BUDGET` bytes, evicting the least
+    /// recently used sets first; larger databases are not cached.
+    pub(crate) fn compile_cached(patterns: &[Pattern]) -> Result<Arc<Self>, Error> {
+        let key = cache_key(patterns);
+
+        {
+            let mut cache = CACHE.lock();
+            if let Some(index) = cache.iter().position(|(cached, _)| *cached == key) {
+                let entry = cache.remove(index);
+                let result = entry.1.clone();
+                cache.push(entry);
+                return result.map_err(Error::PatternTooComplex);
+            }
+        }
+
+        // Compile without holding the lock; a concurrent miss just compiles twice
+        let result = match Self::compile(patterns) {
+            Ok(database) => Ok(Arc::new(database)),
+            Err(Error::PatternTooComplex(reason)) => Err(reason),
+            Err(error) => return Err(error),
+        };
+
+        let entry = (key, result.clone());
+        let size = entry_size(&entry);
+        if size <= CACHE_BUDGET {
+            let mut cache = CACHE.lock();
+            let mut total: usize = cache.iter().map(entry_size).sum();
+            while total + size > CACHE_BUDGET {
+                total -= entry_size(&cache.remove(0));
+            }
+            cache.push(entry);
+        }
+        result.map_err(Error::PatternTooComplex)
+    }
+
+    #[inline]
+    pub(crate) fn next_state(&self, state: u32, byte: u8) -> u32 {
+        self.transitions[state as usize][byte as usize]
+    }
+
+    #[inline]
+    pub(crate) fn matches(&self, state: u32) -> &[(u32, u32)] {
+        &self.matches[state as usize]
+    }
+
+    #[inline]
+    pub(crate) fn prefilter(&self) -> Option<&Prefilter> {
+        self.prefilter.as_ref()
+    }
+
+    pub(crate) fn memory_usage(&self) -> usize {
+        std::mem::size_of_val(self.transitions.as_slice())
+            + self.matches.iter().map(|m| std::mem::size_of_val(m.as_slice())).sum::<usize>()
+    }
+
+    #[cfg(test)]
+    pub(crate) fn num_states(&self) -> usize {
+        self.transitions.len()
+    }
+}
+
+// Bytes a cache entry keeps alive
+fn entry_size((key, result): &CacheEntry) -> usize {
+    let value = match result {
+        Ok(database) => database.memory_usage(),
+        Err(reason) => reason.len(),
+    };
+    std::mem::size_of_val(key.as_slice()) + value
+}
+
+// Structural encoding of a pattern set. Pattern ids are left out since the
+// database only refers to patterns by index.
+fn cache_key(patterns: &[Pattern]) -> Vec<u32> {
+    let mut key = Vec::new();
+
+    for pattern in patterns {
+        key.push(pattern.states.len() as u32);
+        key.push(pattern.initial_state as u32);
+
+        for state in &pattern.states {
+            let mut transitions: Vec<(u8, usize)> =
+                state.transitions.iter().map(|(&byte, &next)| (byte, next)).collect();
+            transitions.sort_unstable();
+
+            key.push(state.is_final as u32);
+            key.push(transitions.len() as u32);
+            for (byte, next) in transitions {
+                key.push(byte as u32);
+                key.push(next as u32);
+            }
+        }
+    }
+
+    key
+}
+
+// Shortest distance of every state from the initial state, used as match length
+pub(crate) fn state_depths(pattern: &Pattern) -> Vec<usize> {
+    let mut depths = vec![usize::MAX; pattern.states.len()];
+    let mut queue = VecDeque::from([pattern.initial_state]);
+    depths[pattern.initial_state] = 0;
+
+    while let Some(state) = queue.pop_front() {
+        for &next in pattern.states[state].transitions.values() {
+            if depths[next] == usize::MAX {
+                depths[next] = depths[state] + 1;
+                queue.push_back(next);
+            }
+        }
+    }
+
+    depths
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::pattern::compile_pattern;
+
+    fn scan(db: &Database, data: &[u8]) -> Vec<(u32, usize)> {
+        let mut state = Database::START;
+        let mut found = Vec::new();
+        for (i, &byte) in data.iter().enumerate() {
+            state = db.next_state(state, byte);
+            for &(pattern, length) in db.matches(state) {
+                found.push((pattern, i + 1 - length as usize));
+            }
+        }
+        found
+    }
+
+    #[test]
+    fn test_combined_matches() {
+        let patterns = vec![
+            compile_pattern("test").unwrap(),
+            compile_pattern("string").unwrap(),
+        ];
+        let db = Database::compile(&patterns).unwrap();
+
+        assert_eq!(scan(&db, b"this is a test string"), vec![(0, 10), (1, 15)]);
+    }
+
+    #[test]
+    fn test_restarts_after_failed_prefix() {
+        let patterns = vec![compile_pattern("ab").unwrap(), compile_pattern("aa").unwrap()];
+        let db = Database::compile(&patterns).unwrap();
+
+        assert_eq!(scan(&db, b"aab"), vec![(1, 0), (0, 1)]);
+        assert_eq!(scan(&db, b"aaaa"), vec![(1, 0), (1, 1), (1, 2)]);
+    }
+
+    #[test]
+    fn test_compile_cached_reuses_database() {
+        let patterns = vec![compile_pattern("cached").unwrap()];
+        let mut renamed = vec![compile_pattern("cached").unwrap()];
+        renamed[0].id = "other".into();
+
+        let first = Database::compile_cached(&patterns).unwrap();
+        let second = Database::compile_cached(&renamed).unwrap();
+        let different = Database::compile_cached(&[compile_pattern("uncached").unwrap()]).unwrap();
+
+        assert!(Arc::ptr_eq(&first, &second));
+        assert!(!Arc::ptr_eq(&first, &different));
+    }
+
+    #[test]
+    fn test_compile_cached_remembers_failures() {
+        let patterns = vec![compile_pattern("too complex").unwrap()];
+        CACHE.lock().push((cache_key(&patterns), Err("cached failure".into())));
+
+        // The cached error is returned instead of compiling the set
+        let result = Database::compile_cached(&patterns);
+        assert!(matches!(result, Err(Error::PatternTooComplex(reason)) if reason == "cached failure"));
+        assert!(CACHE.lock().iter().map(entry_size).sum::<usize>() <= CACHE_BUDGET);
+    }
+
+    #[test]
+    fn test_empty_pattern_set() {
+        let db = Database::compile(&[]).unwrap();
+        assert_eq!(db.num_states(), 1);
+        assert!(scan(&db, b"anything").is_empty());
+    }
+}
@@ -1,12 +1,97 @@
+use numpy::PyArray1;
+use pyo3::buffer::PyBuffer;
+use pyo3::exceptions::PyBufferError;
 use pyo3::prelude::*;
+use pyo3::types::PyList;
 use pyo3::wrap_pyfunction;
 use std::sync::Arc;
-use crate::{StreamMatcher, Pattern, PatternBuilder};
+use arc_swap::ArcSwap;
+use parking_lot::Mutex;
+use crate::{Match, Pattern, PatternBuilder, ScanState, Scanner, compile_alternatives, compile_pattern, is_literal};
 
-/// Python wrapper for StreamMatcher
+/// Matches of one chunk as parallel (positions, lengths, pattern indices) arrays
+type MatchArrays<'py> = (&'py PyArray1<i64>, &'py PyArray1<i32>, &'py PyArray1<u32>);
+
+/// A single pattern match, built on demand when a match batch is iterated.
+///
+/// Only the pattern index is stored; `pattern_id` looks the name up in the
+/// shared id table when it is read.
+#[pyclass]
+#[derive(Clone)]
+pub struct MatchResult {
+    #[pyo3(get)]
+    pattern_index: u32,
+    #[pyo3(get)]
+    position: u64,
+    #[pyo3(get)]
+    length: u32,
+    id_table: Py<PyList>,
+}
+
+#[pymethods]
+impl MatchResult {
+    #[new]
+    fn new(pattern_index: u32, position: u64, length: u32, id_table: Py<PyList>) -> Self {
+        MatchResult { pattern_index, position, length, id_table }
+    }
+
+    #[getter]
+    fn pattern_id<'py>(&self, py: Python<'py>) -> PyResult<&'py PyAny> {
+        self.id_table.as_ref(py).get_item(self.pattern_index as usize)
+    }
+
+    fn __repr__(&self, py: Python<'_>) -> PyResult<String> {
+        Ok(format!(
+            "MatchResult(pattern_id={}, position={}, length={})",
+            self.pattern_id(py)?.repr()?,
+            self.position,
+            self.length
+        ))
+    }
+}
+
+/// One logical stream; matches may span the chunks scanned with it.
+///
+/// A handle is independent of the thread using it, and of other handles on
+/// the same matcher. Chunks scanned with one handle from several threads are
+/// applied one at a time.
+#[pyclass]
+pub struct StreamHandle {
+    // None once the stream is closed
+    state: Mutex<Option<ScanState>>,
+}
+
+#[pymethods]
+impl StreamHandle {
+    /// Number of bytes scanned with this stream so far
+    #[getter]
+    fn bytes_processed(&self) -> usize {
+        self.state.lock().as_ref().map_or(0, ScanState::offset)
+    }
+
+    #[getter]
+    fn closed(&self) -> bool {
+        self.state.lock().is_none()
+    }
+}
+
+/// Python wrapper around a compiled pattern set.
+///
+/// Scans take no lock and release the GIL, so chunks submitted from several
+/// Python threads are scanned in parallel, also while a new pattern set is
+/// being compiled.
+///
+/// `patterns` is only held for short sections that never wait for the GIL,
+/// so threads holding the GIL may take it without risking a deadlock.
 #[pyclass]
 pub struct PyStreamMatcher {
-    matcher: Arc<StreamMatcher>,
+    // Registered patterns; only locked while the set changes
+    patterns: Mutex<Vec<Pattern>>,
+    // Serializes compiles, so the set swapped in last is the latest one.
+    // Only taken with the GIL released.
+    compile_lock: Mutex<()>,
+    // Scans load the current set; a recompiled set is swapped in atomically
+    scanner: ArcSwap<Scanner>,
 }
 
 #[pymethods]
@@ -14,40 +99,248 @@ impl PyStreamMatcher {
     #[new]
     fn new() -> Self {
         PyStreamMatcher {
-            matcher: Arc::new(StreamMatcher::new())
+            patterns: Mutex::new(Vec::new()),
+            compile_lock: Mutex::new(()),
+            scanner: ArcSwap::from_pointee(Scanner::new(Vec::new())),
         }
     }
 
-    fn add_pattern(&mut self, pattern: &str, pattern_id: Option<String>) -> PyResult<String> {
-        let id = pattern_id.unwrap_or_else(|| format!("pattern_{}", self.matcher.patterns.len()));
-        let mut builder = PatternBuilder::new();
+    /// Add a single pattern and return its index, as reported with its
+    /// matches. Same as `compile_patterns` with one pattern, but patterns
+    /// the automaton cannot express are rejected.
+    ///
+    /// Only for using this class directly: the Python StreamMatcher keeps
+    /// its id table in step with `compile_patterns`, so mixing in patterns
+    /// added here would shift the indices it reports.
+    fn add_pattern(&self, py: Python<'_>, pattern: &str, pattern_id: Option<String>) -> PyResult<u32> {
+        if !is_literal(pattern) {
+            return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(
+                "regex syntax is only supported by the Python StreamMatcher",
+            ));
+        }
+        let id = pattern_id.unwrap_or_else(|| format!("pattern_{}", self.patterns.lock().len()));
+        let (index, _) = self.register_patterns(py, vec![Some(pattern.to_owned())], vec![id], None)?;
+        Ok(index as u32)
+    }
 
-        // Convert the Python pattern string to our Pattern type
-        // This is simplified - you'd want more robust pattern parsing
-        let pattern = builder.build(id.clone());
+    /// Name of the pattern at `index`
+    fn pattern_id_to_name(&self, index: usize) -> PyResult<String> {
+        self.patterns
+            .lock()
+            .get(index)
+            .map(|pattern| pattern.id.clone())
+            .ok_or_else(|| PyErr::new::<pyo3::exceptions::PyIndexError, _>("pattern index out of range"))
+    }
 
-        Arc::get_mut(&mut self.matcher)
-            .ok_or_else(|| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>("Failed to get mutable reference"))?
-            .add_pattern(pattern);
+    /// Compile a whole pattern set into one automaton in a single call.
+    ///
+    /// Returns the indices of patterns that are `None` or use regex syntax the
+    /// automaton cannot express; the caller is expected to evaluate those
+    /// itself. Their ids are still registered, so pattern indices match the
+    /// order of `patterns`.
+    ///
+    /// `factors` optionally gives, for every pattern, literals one of which
+    /// occurs in each of its matches (in `compile_pattern` syntax). The
+    /// automaton reports where they occur under the index of an unsupported
+    /// pattern, so the caller only needs to evaluate it where they do; such
+    /// reports are not matches of the pattern itself.
+    #[pyo3(signature = (patterns, ids, factors = None))]
+    fn compile_patterns(
+        &self,
+        py: Python<'_>,
+        patterns: Vec<Option<String>>,
+        ids: Vec<String>,
+        factors: Option<Vec<Vec<String>>>,
+    ) -> PyResult<Vec<usize>> {
+        let (_, unsupported) = self.register_patterns(py, patterns, ids, factors)?;
+        Ok(unsupported)
+    }
+
+    /// Scan a chunk on its own and return all of its matches at once, as
+    /// arrays. Positions are relative to the start of the chunk.
+    fn process_chunk<'py>(&self, py: Python<'py>, data: &[u8]) -> MatchArrays<'py> {
+        let matches = py.allow_threads(|| self.scan_block(data));
+        match_arrays(py, matches)
+    }
 
-        Ok(id)
+    /// Process any C-contiguous object exposing the buffer protocol without
+    /// copying it. The buffer must not be modified until the call returns.
+    fn process_chunk_buffer<'py>(&self, py: Python<'py>, buf: PyBuffer<u8>) -> PyResult<MatchArrays<'py>> {
+        let data = buffer_slice(py, &buf)?;
+        let matches = py.allow_threads(|| self.scan_block(data));
+        Ok(match_arrays(py, matches))
     }
 
-    fn process_chunk(&mut self, data: &[u8]) -> PyResult<()> {
-        Arc::get_mut(&mut self.matcher)
-            .ok_or_else(|| PyErr::new::<pyo3::exceptions::PyRuntimeError, _>("Failed to get mutable reference"))?
-            .process_chunk(data);
-        Ok(())
+    /// Start a new stream at offset 0
+    fn open_stream(&self) -> StreamHandle {
+        StreamHandle { state: Mutex::new(Some(ScanState::new())) }
+    }
+
+    /// Continue `stream` with the next chunk. Returns the stream offset of the
+    /// chunk along with its matches, whose positions are stream offsets too.
+    ///
+    /// If patterns were added since the previous chunk, matching restarts at
+    /// this chunk. As with `process_chunk_buffer`, the buffer must not be
+    /// modified until the call returns.
+    fn process_stream_chunk_buffer<'py>(
+        &self,
+        py: Python<'py>,
+        stream: PyRef<'_, StreamHandle>,
+        buf: PyBuffer<u8>,
+    ) -> PyResult<(usize, MatchArrays<'py>)> {
+        let data = buffer_slice(py, &buf)?;
+        let stream: &StreamHandle = &stream;
+        let scanned = py.allow_threads(|| {
+            let mut state = stream.state.lock();
+            let state = state.as_mut()?;
+            let offset = state.offset();
+            let mut matches = Vec::new();
+            self.scanner.load().scan(state, data, &mut matches);
+            Some((offset, matches))
+        });
+
+        let (offset, matches) = scanned.ok_or_else(|| PyErr::new::<pyo3::exceptions::PyValueError, _>("stream is closed"))?;
+        Ok((offset, match_arrays(py, matches)))
+    }
+
+    /// Close `stream` and return the number of bytes scanned with it.
+    ///
+    /// No pattern matches at the end of the data only, so there are no
+    /// matches left to report.
+    fn close_stream(&self, stream: PyRef<'_, StreamHandle>) -> PyResult<usize> {
+        stream
+            .state
+            .lock()
+            .take()
+            .map(|state| state.offset())
+            .ok_or_else(|| PyErr::new::<pyo3::exceptions::PyValueError, _>("stream is closed"))
     }
 
     fn memory_usage(&self) -> usize {
-        self.matcher.memory_usage()
+        self.scanner.load().memory_usage()
+    }
+
+    /// Drop all patterns and the compiled set. Scans already running keep
+    /// the set they loaded until they finish; a compile in progress finishes
+    /// first, so it cannot swap its set in afterwards.
+    fn close(&self, py: Python<'_>) {
+        py.allow_threads(|| {
+            let _compiling = self.compile_lock.lock();
+            self.patterns.lock().clear();
+            self.scanner.store(Arc::new(Scanner::new(Vec::new())));
+        });
     }
 }
 
+impl PyStreamMatcher {
+    // Compile `patterns` and append them to the set; returns the index of
+    // the first one and the indices of those left to the caller
+    fn register_patterns(
+        &self,
+        py: Python<'_>,
+        patterns: Vec<Option<String>>,
+        ids: Vec<String>,
+        factors: Option<Vec<Vec<String>>>,
+    ) -> PyResult<(usize, Vec<usize>)> {
+        let factors = factors.unwrap_or_else(|| vec![Vec::new(); patterns.len()]);
+        if patterns.len() != ids.len() || patterns.len() != factors.len() {
+            return Err(PyErr::new::<pyo3::exceptions::PyValueError, _>(
+                "patterns, ids and factors must have the same length",
+            ));
+        }
+
+        let mut compiled_patterns = Vec::with_capacity(patterns.len());
+        let mut unsupported = Vec::new();
+
+        for (index, ((pattern, id), factors)) in patterns.iter().zip(ids).zip(&factors).enumerate() {
+            let compiled = if let Some(pattern) = pattern.as_deref().filter(|p| is_literal(p)) {
+                let mut compiled = compile_pattern(pattern)
+                    .map_err(|e| PyErr::new::<pyo3::exceptions::PyValueError, _>(e.to_string()))?;
+                compiled.id = id;
+                compiled
+            } else if !factors.is_empty() {
+                unsupported.push(index);
+                compile_alternatives(factors, id)
+                    .map_err(|e| PyErr::new::<pyo3::exceptions::PyValueError, _>(e.to_string()))?
+            } else {
+                unsupported.push(index);
+                // A pattern without transitions never matches
+                PatternBuilder::new()
+                    .build(id)
+                    .map_err(|e| PyErr::new::<pyo3::exceptions::PyValueError, _>(e.to_string()))?
+            };
+            compiled_patterns.push(compiled);
+        }
+
+        // Registered only once every pattern compiled, so a failure leaves
+        // the set unchanged
+        let first_index = {
+            let mut registered = self.patterns.lock();
+            registered.extend(compiled_patterns);
+            registered.len() - patterns.len()
+        };
+        self.recompile(py);
+        Ok((first_index, unsupported))
+    }
+
+    fn recompile(&self, py: Python<'_>) {
+        // Compile a snapshot without the GIL or the patterns lock; scans keep
+        // using the previous set until the new one is swapped in
+        py.allow_threads(|| {
+            let _compiling = self.compile_lock.lock();
+            let patterns = self.patterns.lock().clone();
+            self.scanner.store(Arc::new(Scanner::new(patterns)));
+        });
+    }
+
+    // Block mode: every call starts from a fresh state
+    fn scan_block(&self, data: &[u8]) -> Vec<Match> {
+        let mut matches = Vec::new();
+        self.scanner.load().scan(&mut ScanState::new(), data, &mut matches);
+        matches
+    }
+}
+
+// Borrow the bytes of a C-contiguous buffer without copying them.
+//
+// The slice is read with the GIL released, so it is only sound as long as
+// nothing writes to the buffer during the call. That is guaranteed for
+// immutable objects such as bytes; for writable buffers (bytearray, NumPy
+// arrays, mmap) it is part of the documented contract of process_chunk that
+// callers must not mutate them from another thread while it runs.
+fn buffer_slice<'a>(py: Python<'a>, buf: &'a PyBuffer<u8>) -> PyResult<&'a [u8]> {
+    let cells = buf
+        .as_slice(py)
+        .ok_or_else(|| PyBufferError::new_err("Buffer must be C-contiguous"))?;
+    // SAFETY: ReadOnlyCell<u8> is repr(transparent) over u8, the buffer stays
+    // exported (and therefore alive and unmoved) until `buf` is dropped, and
+    // callers must not mutate it meanwhile (see above)
+    Ok(unsafe { std::slice::from_raw_parts(cells.as_ptr() as *const u8, cells.len()) })
+}
+
+fn match_arrays(py: Python<'_>, matches: Vec<Match>) -> MatchArrays<'_> {
+    let mut positions = Vec::with_capacity(matches.len());
+    let mut lengths = Vec::with_capacity(matches.len());
+    let mut pattern_ids = Vec::with_capacity(matches.len());
+    for found in matches {
+        positions.push(found.position as i64);
+        lengths.push(found.length as i32);
+        pattern_ids.push(found.pattern as u32);
+    }
+
+    // from_vec hands the allocations to NumPy without copying them
+    (
+        PyArray1::from_vec(py, positions),
+        PyArray1::from_vec(py, lengths),
+        PyArray1::from_vec(py, pattern_ids),
+    )
+}
+
 // Module initialization
 #[pymodule]
 fn streamregex_rust(_py: Python, m: &PyModule) -> PyResult<()> {
     m.add_class::<PyStreamMatcher>()?;
+    m.add_class::<MatchResult>()?;
+    m.add_class::<StreamHandle>()?;
     Ok(())
-}
\ No newline at end of file
+}
@@ -5,16 +5,21 @@
 
 #![warn(missing_docs)]
 
+mod database;
 mod error;
 mod matcher;
 mod pattern;
+mod prefilter;
+mod scanner;
+mod shift_and;
 
 #[cfg(feature = "python")]
 pub mod ffi;
 
 pub use error::Error;
 pub use matcher::StreamMatcher;
-pub use pattern::{Pattern, PatternBuilder, compile_pattern};
+pub use pattern::{Pattern, PatternBuilder, compile_alternatives, compile_pattern, is_literal};
+pub use scanner::{Match, ScanState, Scanner};
 
 /// Result type for StreamRegex operations
 pub type Result<T> = std::result::Result<T, Error>;
@@ -1,25 +1,17 @@
-use std::collections::HashMap;
 use std::sync::atomic::{AtomicUsize, Ordering};
 use std::sync::Arc;
 
-// Core types for pattern matching
-#[derive(Debug, Clone)]
-pub struct Pattern {
-    pub(crate) id: String,
-    pub(crate) states: Vec<State>,
-    pub(crate) initial_state: usize,
-}
-
-#[derive(Debug, Clone)]
-pub(crate) struct State {
-    transitions: HashMap<u8, usize>,
-    is_final: bool,
-}
+use crate::pattern::Pattern;
+use crate::scanner::{Match, ScanState, Scanner};
+use crate::Result;
 
 // StreamMatcher is the main interface for pattern matching
 pub struct StreamMatcher {
     patterns: Vec<Pattern>,
-    current_states: Vec<usize>,
+    // None while patterns changed since the last compile
+    scanner: Option<Scanner>,
+    scan_state: ScanState,
+    scratch: Vec<Match>,
     memory_usage: Arc<AtomicUsize>,
     callbacks: Vec<Box<dyn Fn(&str) + Send + Sync>>,
 }
@@ -28,15 +20,19 @@ impl StreamMatcher {
     pub fn new() -> Self {
         StreamMatcher {
             patterns: Vec::new(),
-            current_states: Vec::new(),
+            scanner: None,
+            scan_state: ScanState::new(),
+            scratch: Vec::new(),
             memory_usage: Arc::new(AtomicUsize::new(0)),
             callbacks: Vec::new(),
         }
     }
 
+    /// Add a pattern. Matching restarts from the initial state of every
+    /// pattern once the set is recompiled.
     pub fn add_pattern(&mut self, pattern: Pattern) {
-        self.current_states.push(pattern.initial_state);
         self.patterns.push(pattern);
+        self.scanner = None;
     }
 
     pub fn add_callback<F>(&mut self, callback: F)
@@ -46,31 +42,83 @@ impl StreamMatcher {
         self.callbacks.push(Box::new(callback));
     }
 
+    pub fn num_patterns(&self) -> usize {
+        self.patterns.len()
+    }
+
+    pub fn pattern_id(&self, pattern: usize) -> &str {
+        &self.patterns[pattern].id
+    }
+
+    /// Number of bytes processed so far; match positions are relative to this
+    pub fn bytes_processed(&self) -> usize {
+        self.scan_state.offset()
+    }
+
+    /// Compile all patterns into a single automaton.
+    ///
+    /// Called lazily by `process_chunk`. Pattern sets compiled before in this
+    /// process are reused. If the combined automaton would be too
+    /// large the error is returned and matching falls back to stepping each
+    /// pattern separately.
+    pub fn compile(&mut self) -> Result<()> {
+        let (scanner, error) = Scanner::compile(self.patterns.clone());
+        self.scanner = Some(scanner);
+        error.map_or(Ok(()), Err)
+    }
+
     pub fn process_byte(&mut self, byte: u8) {
-        for (pattern_idx, current_state) in self.current_states.iter_mut().enumerate() {
-            let pattern = &self.patterns[pattern_idx];
-
-            if let Some(next_state) = pattern.states[*current_state].transitions.get(&byte) {
-                *current_state = *next_state;
-
-                if pattern.states[*current_state].is_final {
-                    for callback in &self.callbacks {
-                        callback(&pattern.id);
-                    }
-                }
-            } else {
-                *current_state = pattern.initial_state;
+        self.process_chunk(std::slice::from_ref(&byte));
+    }
+
+    pub fn process_chunk(&mut self, data: &[u8]) {
+        let mut matches = std::mem::take(&mut self.scratch);
+        self.scan_chunk(data, &mut matches);
+
+        for found in matches.drain(..) {
+            for callback in &self.callbacks {
+                callback(&self.patterns[found.pattern].id);
             }
         }
+        self.scratch = matches;
     }
 
-    pub fn process_chunk(&mut self, data: &[u8]) {
-        for &byte in data {
-            self.process_byte(byte);
+    /// Process a chunk and append its matches to `matches` instead of invoking
+    /// the callbacks, so callers can hand over all matches of a chunk at once.
+    pub fn scan_chunk(&mut self, data: &[u8], matches: &mut Vec<Match>) {
+        if self.scanner.is_none() {
+            // Errors only select the slower engine, they are not fatal
+            let _ = self.compile();
+        }
+
+        if let Some(scanner) = &self.scanner {
+            scanner.scan(&mut self.scan_state, data, matches);
         }
     }
 
     pub fn memory_usage(&self) -> usize {
         self.memory_usage.load(Ordering::Relaxed)
     }
-}
\ No newline at end of file
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::pattern::compile_pattern;
+
+    #[test]
+    fn test_match_positions_across_chunks() {
+        let mut matcher = StreamMatcher::new();
+        matcher.add_pattern(compile_pattern("needle").unwrap());
+
+        let mut matches = Vec::new();
+        matcher.scan_chunk(b"hay nee", &mut matches);
+        matcher.scan_chunk(b"dle hay needle", &mut matches);
+
+        assert_eq!(matches, vec![
+            Match { pattern: 0, position: 4, length: 6 },
+            Match { pattern: 0, position: 15, length: 6 },
+        ]);
+        assert_eq!(matcher.bytes_processed(), 21);
+    }
+}
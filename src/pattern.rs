@@ -14,6 +14,50 @@ pub(crate) struct State {
     pub(crate) is_final: bool,
 }
 
+impl Pattern {
+    /// The bytes accepted at each position if this pattern is a plain chain
+    /// of states, each leading only to the next one and only the last final
+    pub(crate) fn chain(&self) -> Option<Vec<Vec<u8>>> {
+        let mut chain = Vec::new();
+        let mut state = &self.states[self.initial_state];
+
+        while !state.is_final {
+            let mut next_states = state.transitions.values();
+            let next = *next_states.next()?;
+            if next_states.any(|&other| other != next) || chain.len() >= self.states.len() {
+                return None;
+            }
+            let mut bytes: Vec<u8> = state.transitions.keys().copied().collect();
+            bytes.sort_unstable();
+            chain.push(bytes);
+            state = &self.states[next];
+        }
+
+        // Every state must be on the chain, and the chain must end at the match
+        let complete = chain.len() + 1 == self.states.len() && state.transitions.is_empty();
+        (complete && !chain.is_empty()).then_some(chain)
+    }
+
+    /// Whether no input can ever reach a final state, as for the placeholders
+    /// registered for patterns that are evaluated elsewhere
+    pub(crate) fn never_matches(&self) -> bool {
+        let initial = &self.states[self.initial_state];
+        !initial.is_final && initial.transitions.is_empty()
+    }
+
+    /// The bytes matched by this pattern if it is a chain of single bytes, as
+    /// built by `compile_pattern` for a literal
+    pub(crate) fn literal(&self) -> Option<Vec<u8>> {
+        self.chain()?
+            .into_iter()
+            .map(|bytes| match bytes[..] {
+                [byte] => Some(byte),
+                _ => None,
+            })
+            .collect()
+    }
+}
+
 pub struct PatternBuilder {
     states: Vec<State>,
     transitions: Vec<(usize, u8, usize)>,
@@ -78,15 +122,80 @@ pub fn compile_pattern(pattern: &str) -> Result<Pattern, Error> {
     let mut builder = PatternBuilder::new();
     let mut current_state = 0;
 
-    for (i, byte) in pattern.bytes().enumerate() {
-        let next_state = builder.add_state(i == pattern.len() - 1);
+    // A leading (?i) makes ASCII letters match in either case
+    let (literal, ignore_case) = match pattern.strip_prefix(IGNORE_CASE) {
+        Some(literal) => (literal, true),
+        None => (pattern, false),
+    };
+
+    for (i, byte) in literal.bytes().enumerate() {
+        let next_state = builder.add_state(i == literal.len() - 1);
         builder.add_transition(current_state, byte, next_state);
+        if ignore_case && byte.is_ascii_alphabetic() {
+            builder.add_transition(current_state, byte ^ 0x20, next_state);
+        }
         current_state = next_state;
     }
 
     builder.build(pattern.to_string())
 }
 
+const IGNORE_CASE: &str = "(?i)";
+
+/// Convert several literals into one pattern that matches wherever any of
+/// them occurs, sharing states between common prefixes. Letters match in
+/// either case in all of them if any has a leading `(?i)`.
+pub fn compile_alternatives(literals: &[String], id: String) -> Result<Pattern, Error> {
+    let ignore_case = literals.iter().any(|literal| literal.starts_with(IGNORE_CASE));
+
+    // Trie of (transitions, is_final), built before the pattern since a
+    // literal may end at a state created for a longer one
+    let mut trie: Vec<(HashMap<u8, usize>, bool)> = vec![(HashMap::new(), false)];
+    for literal in literals {
+        let literal = literal.strip_prefix(IGNORE_CASE).unwrap_or(literal);
+        if literal.is_empty() {
+            return Err(Error::InvalidPattern("Alternatives must not be empty".into()));
+        }
+
+        let mut state = 0;
+        for byte in literal.bytes() {
+            let byte = if ignore_case { byte.to_ascii_lowercase() } else { byte };
+            state = match trie[state].0.get(&byte) {
+                Some(&next) => next,
+                None => {
+                    trie.push((HashMap::new(), false));
+                    let next = trie.len() - 1;
+                    trie[state].0.insert(byte, next);
+                    next
+                }
+            };
+        }
+        trie[state].1 = true;
+    }
+
+    let mut builder = PatternBuilder::new();
+    for &(_, is_final) in &trie[1..] {
+        builder.add_state(is_final);
+    }
+    for (state, (transitions, _)) in trie.iter().enumerate() {
+        for (&byte, &next) in transitions {
+            builder.add_transition(state, byte, next);
+            if ignore_case && byte.is_ascii_alphabetic() {
+                builder.add_transition(state, byte.to_ascii_uppercase(), next);
+            }
+        }
+    }
+
+    builder.build(id)
+}
+
+/// Whether `compile_pattern` can handle the pattern, i.e. it uses no regex
+/// syntax apart from an optional leading `(?i)`
+pub fn is_literal(pattern: &str) -> bool {
+    let literal = pattern.strip_prefix(IGNORE_CASE).unwrap_or(pattern);
+    !literal.bytes().any(|byte| b"\\.^$|?*+()[]{}".contains(&byte))
+}
+
 #[cfg(test)]
 mod tests {
     use super::*;
@@ -107,10 +216,56 @@ mod tests {
         assert!(pattern.states[s2].is_final);
     }
 
+    #[test]
+    fn test_compile_alternatives() {
+        let literals = vec!["../".to_string(), "(?i)%2e%2e%2f".to_string(), "..\\".to_string()];
+        let pattern = compile_alternatives(&literals, "traversal".into()).unwrap();
+
+        // "../" and "..\\" share their first two states
+        assert_eq!(pattern.states.len(), 1 + 3 + 1 + 9);
+        assert_eq!(pattern.states.iter().filter(|state| state.is_final).count(), 3);
+        assert_eq!(pattern.states[0].transitions.len(), 2);
+        assert!(compile_alternatives(&["".to_string()], "empty".into()).is_err());
+    }
+
     #[test]
     fn test_compile_pattern() {
         let pattern = compile_pattern("abc").unwrap();
         assert_eq!(pattern.states.len(), 4); // initial + 3 states
         assert!(pattern.states.last().unwrap().is_final);
     }
+
+    #[test]
+    fn test_is_literal() {
+        assert!(is_literal("union select"));
+        assert!(!is_literal(r"\.\./"));
+        assert!(!is_literal("a+b+c+"));
+        assert!(is_literal("(?i)union"));
+        assert!(!is_literal("(?i)a+"));
+    }
+
+    #[test]
+    fn test_compile_pattern_ignore_case() {
+        let pattern = compile_pattern("(?i)a1").unwrap();
+        assert_eq!(pattern.states.len(), 3);
+        assert_eq!(pattern.states[0].transitions.len(), 2);
+        assert_eq!(pattern.states[1].transitions.len(), 1);
+        assert_eq!(pattern.literal(), None);
+        assert_eq!(pattern.chain(), Some(vec![b"Aa".to_vec(), b"1".to_vec()]));
+    }
+
+    #[test]
+    fn test_literal() {
+        assert_eq!(compile_pattern("abc").unwrap().literal(), Some(b"abc".to_vec()));
+        assert_eq!(PatternBuilder::new().build("empty".into()).unwrap().literal(), None);
+
+        let mut builder = PatternBuilder::new();
+        let s1 = builder.add_state(false);
+        let s2 = builder.add_state(true);
+        builder
+            .add_transition(0, b'a', s1)
+            .add_transition(s1, b'b', s2)
+            .add_transition(s1, b'c', s2);
+        assert_eq!(builder.build("branch".into()).unwrap().literal(), None);
+    }
 }
\ No newline at end of file
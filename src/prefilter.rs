@@ -0,0 +1,261 @@
+// Skips input that cannot leave the start state of a `Database`.
+//
+// While the combined automaton sits in its start state, only bytes that
+// begin some pattern can change that. Finding the next such byte is a byte
+// set search, done here with the nibble-shuffle trick from Teddy: two
+// `pshufb` lookups (low and high nibble) give a candidate bit per byte,
+// 16 bytes per step with SSSE3 or 32 with AVX2.
+//
+// Case-insensitive patterns put both cases of each letter in the set. Such
+// sets are folded: only the lowercase letters go into the tables, and the
+// kernels lowercase each register before the lookups, so the set stays
+// small without writing a lowercased copy of the input anywhere.
+
+/// Sets larger than this stop the scan too often for skipping to pay off
+pub(crate) const MAX_SET_SIZE: usize = 32;
+
+/// Below this many bytes AVX2 does not win back its per-call overhead
+pub(crate) const WIDE_THRESHOLD: usize = 4 * 1024;
+
+type FindFn = unsafe fn(&Prefilter, &[u8]) -> Option<usize>;
+
+#[derive(Clone)]
+pub(crate) struct Prefilter {
+    set: [bool; 256],
+    // Bit (hi & 7) of lo_table[lo] is set for every byte (hi << 4 | lo) in the
+    // set; hi_table[hi] is that bit if some byte in the set has high nibble hi
+    lo_table: [u8; 16],
+    hi_table: [u8; 16],
+    // Input is lowercased before the table lookups
+    fold: bool,
+    // Selected once at construction so the hot loop never re-detects features
+    find_narrow: FindFn,
+    find_wide: FindFn,
+}
+
+impl std::fmt::Debug for Prefilter {
+    fn fmt(&self, f: &mut std::fmt::Formatter<'_>) -> std::fmt::Result {
+        f.debug_struct("Prefilter")
+            .field("bytes", &self.set.iter().filter(|&&b| b).count())
+            .field("fold", &self.fold)
+            .finish()
+    }
+}
+
+impl Prefilter {
+    /// Build a prefilter for `bytes`, or `None` if the set is too dense to help
+    pub(crate) fn new(bytes: impl IntoIterator<Item = u8>) -> Option<Self> {
+        let mut set = [false; 256];
+        for byte in bytes {
+            set[byte as usize] = true;
+        }
+
+        let has_letters = (b'a'..=b'z').any(|lower| set[lower as usize]);
+        let fold = has_letters && (b'A'..=b'Z').all(|upper| set[upper as usize] == set[(upper | 0x20) as usize]);
+
+        let mut lo_table = [0u8; 16];
+        let mut hi_table = [0u8; 16];
+        let mut len = 0;
+        for byte in (0..=255u8).filter(|&byte| set[byte as usize] && !(fold && byte.is_ascii_uppercase())) {
+            let bucket = 1 << ((byte >> 4) & 7);
+            lo_table[(byte & 0x0f) as usize] |= bucket;
+            // High nibbles without bytes in the set select no bucket at all,
+            // so e.g. for ASCII sets binary data never yields candidates
+            hi_table[(byte >> 4) as usize] = bucket;
+            len += 1;
+        }
+        if len == 0 || len > MAX_SET_SIZE {
+            return None;
+        }
+
+        let (find_narrow, find_wide) = select_kernels(fold);
+        Some(Prefilter { set, lo_table, hi_table, fold, find_narrow, find_wide })
+    }
+
+    /// Position of the first byte of `haystack` that is in the set
+    #[inline]
+    pub(crate) fn find(&self, haystack: &[u8]) -> Option<usize> {
+        let find = if haystack.len() >= WIDE_THRESHOLD { self.find_wide } else { self.find_narrow };
+        // Kernels are only selected when the CPU supports them
+        unsafe { find(self, haystack) }
+    }
+
+    #[inline]
+    fn contains(&self, byte: u8) -> bool {
+        self.set[byte as usize]
+    }
+
+    // Resolve candidate bits to the first byte that is really in the set;
+    // buckets still alias bytes whose high nibbles differ by 8 if both occur
+    // in the set, and bytes sharing a low nibble with another set member
+    #[inline]
+    fn confirm(&self, haystack: &[u8], offset: usize, mut candidates: u32) -> Option<usize> {
+        while candidates != 0 {
+            let pos = offset + candidates.trailing_zeros() as usize;
+            if self.contains(haystack[pos]) {
+                return Some(pos);
+            }
+            candidates &= candidates - 1;
+        }
+        None
+    }
+}
+
+fn select_kernels(fold: bool) -> (FindFn, FindFn) {
+    #[cfg(target_arch = "x86_64")]
+    {
+        if is_x86_feature_detected!("avx2") {
+            return match fold {
+                true => (x86::find_ssse3::<true>, x86::find_avx2::<true>),
+                false => (x86::find_ssse3::<false>, x86::find_avx2::<false>),
+            };
+        }
+        if is_x86_feature_detected!("ssse3") {
+            return match fold {
+                true => (x86::find_ssse3::<true>, x86::find_ssse3::<true>),
+                false => (x86::find_ssse3::<false>, x86::find_ssse3::<false>),
+            };
+        }
+    }
+    let _ = fold;
+    (find_scalar, find_scalar)
+}
+
+// The set holds both cases of folded letters, so no lowercasing is needed here
+unsafe fn find_scalar(prefilter: &Prefilter, haystack: &[u8]) -> Option<usize> {
+    haystack.iter().position(|&byte| prefilter.contains(byte))
+}
+
+#[cfg(target_arch = "x86_64")]
+mod x86 {
+    use std::arch::x86_64::*;
+    use super::{Prefilter, find_scalar};
+
+    // 'A'..='Z' land on -128..=-103 after adding this, and nothing else does
+    const UPPER_SHIFT: i8 = (128 - b'A') as i8;
+    const UPPER_LIMIT: i8 = -128 + 26;
+
+    #[target_feature(enable = "ssse3")]
+    pub(super) unsafe fn find_ssse3<const FOLD: bool>(prefilter: &Prefilter, haystack: &[u8]) -> Option<usize> {
+        unsafe {
+            let lo_table = _mm_loadu_si128(prefilter.lo_table.as_ptr() as *const __m128i);
+            let hi_table = _mm_loadu_si128(prefilter.hi_table.as_ptr() as *const __m128i);
+            let nibble = _mm_set1_epi8(0x0f);
+            let zero = _mm_setzero_si128();
+
+            let mut i = 0;
+            while i + 16 <= haystack.len() {
+                let mut chunk = _mm_loadu_si128(haystack.as_ptr().add(i) as *const __m128i);
+                if FOLD {
+                    let shifted = _mm_add_epi8(chunk, _mm_set1_epi8(UPPER_SHIFT));
+                    let upper = _mm_cmpgt_epi8(_mm_set1_epi8(UPPER_LIMIT), shifted);
+                    chunk = _mm_or_si128(chunk, _mm_and_si128(upper, _mm_set1_epi8(0x20)));
+                }
+                let lo = _mm_and_si128(chunk, nibble);
+                let hi = _mm_and_si128(_mm_srli_epi16(chunk, 4), nibble);
+                let buckets = _mm_and_si128(_mm_shuffle_epi8(lo_table, lo), _mm_shuffle_epi8(hi_table, hi));
+
+                let candidates = !_mm_movemask_epi8(_mm_cmpeq_epi8(buckets, zero)) as u32 & 0xffff;
+                if let Some(pos) = prefilter.confirm(haystack, i, candidates) {
+                    return Some(pos);
+                }
+                i += 16;
+            }
+
+            find_scalar(prefilter, &haystack[i..]).map(|pos| i + pos)
+        }
+    }
+
+    #[target_feature(enable = "avx2")]
+    pub(super) unsafe fn find_avx2<const FOLD: bool>(prefilter: &Prefilter, haystack: &[u8]) -> Option<usize> {
+        unsafe {
+            // vpshufb looks up within each 128-bit lane, so both lanes get the table
+            let lo_table = _mm256_broadcastsi128_si256(_mm_loadu_si128(prefilter.lo_table.as_ptr() as *const __m128i));
+            let hi_table = _mm256_broadcastsi128_si256(_mm_loadu_si128(prefilter.hi_table.as_ptr() as *const __m128i));
+            let nibble = _mm256_set1_epi8(0x0f);
+            let zero = _mm256_setzero_si256();
+
+            let mut i = 0;
+            while i + 32 <= haystack.len() {
+                let mut chunk = _mm256_loadu_si256(haystack.as_ptr().add(i) as *const __m256i);
+                if FOLD {
+                    let shifted = _mm256_add_epi8(chunk, _mm256_set1_epi8(UPPER_SHIFT));
+                    let upper = _mm256_cmpgt_epi8(_mm256_set1_epi8(UPPER_LIMIT), shifted);
+                    chunk = _mm256_or_si256(chunk, _mm256_and_si256(upper, _mm256_set1_epi8(0x20)));
+                }
+                let lo = _mm256_and_si256(chunk, nibble);
+                let hi = _mm256_and_si256(_mm256_srli_epi16(chunk, 4), nibble);
+                let buckets = _mm256_and_si256(_mm256_shuffle_epi8(lo_table, lo), _mm256_shuffle_epi8(hi_table, hi));
+
+                let candidates = !_mm256_movemask_epi8(_mm256_cmpeq_epi8(buckets, zero)) as u32;
+                if let Some(pos) = prefilter.confirm(haystack, i, candidates) {
+                    return Some(pos);
+                }
+                i += 32;
+            }
+
+            find_ssse3::<FOLD>(prefilter, &haystack[i..]).map(|pos| i + pos)
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_find_agrees_with_scalar() {
+        let prefilter = Prefilter::new(b"tx".iter().copied()).unwrap();
+
+        let mut haystack = vec![b'a'; 3 * WIDE_THRESHOLD];
+        for &pos in &[5, 17, 40, WIDE_THRESHOLD + 3, 3 * WIDE_THRESHOLD - 1] {
+            // 0xf4 and 0xf8 share their low nibbles with 't' and 'x'
+            haystack[pos - 1] = if pos % 2 == 0 { 0xf8 } else { 0xf4 };
+            haystack[pos] = if pos % 2 == 0 { b'x' } else { b't' };
+        }
+
+        let mut start = 0;
+        let mut found = 0;
+        while let Some(pos) = prefilter.find(&haystack[start..]) {
+            assert_eq!(Some(pos), unsafe { find_scalar(&prefilter, &haystack[start..]) });
+            start += pos + 1;
+            found += 1;
+        }
+        assert_eq!(found, 5);
+    }
+
+    #[test]
+    fn test_folded_sets() {
+        let prefilter = Prefilter::new(b"uUsS<".iter().copied()).unwrap();
+        assert!(prefilter.fold);
+        assert!(!Prefilter::new(b"uUs".iter().copied()).unwrap().fold);
+
+        // '@' and '[' sit right outside 'A'..='Z' and must not be lowercased
+        let mut haystack = vec![b'@'; 3 * WIDE_THRESHOLD];
+        for (i, &byte) in b"[U<s{S".iter().enumerate() {
+            haystack[7 + i * 1000] = byte;
+        }
+
+        let mut start = 0;
+        let mut found = Vec::new();
+        while let Some(pos) = prefilter.find(&haystack[start..]) {
+            assert_eq!(Some(pos), unsafe { find_scalar(&prefilter, &haystack[start..]) });
+            found.push(haystack[start + pos]);
+            start += pos + 1;
+        }
+        assert_eq!(found, b"U<sS");
+    }
+
+    #[test]
+    fn test_unused_high_nibbles_select_nothing() {
+        let prefilter = Prefilter::new(b"tx".iter().copied()).unwrap();
+        assert_eq!(prefilter.hi_table[0x7], 1 << 7);
+        assert!(prefilter.hi_table.iter().enumerate().all(|(hi, &bucket)| hi == 0x7 || bucket == 0));
+    }
+
+    #[test]
+    fn test_dense_sets_are_rejected() {
+        assert!(Prefilter::new(0..=255).is_none());
+        assert!(Prefilter::new(std::iter::empty()).is_none());
+    }
+}
@@ -0,0 +1,596 @@
+use std::sync::Arc;
+use std::sync::atomic::{AtomicU64, Ordering};
+
+use memchr::memmem::Finder;
+
+use crate::database::{Database, state_depths};
+use crate::error::Error;
+use crate::pattern::Pattern;
+use crate::shift_and::ShiftAnd;
+
+// Distinguishes scanners so a ScanState is never applied to the wrong one
+static NEXT_GENERATION: AtomicU64 = AtomicU64::new(0);
+
+// Per-CPU builds of the automaton loop, see `select_automaton_kernel`
+type ScanFn = unsafe fn(&Scanner, &mut ScanState, &[u8], &mut Vec<Match>);
+
+/// Each literal is searched in its own pass over the data, so beyond this many
+/// the combined automaton is faster
+pub(crate) const MAX_LITERALS: usize = 8;
+
+/// A single pattern match reported by `Scanner::scan`
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub struct Match {
+    /// Index of the matching pattern, in the order patterns were added
+    pub pattern: usize,
+    /// Stream offset of the first matched byte
+    pub position: usize,
+    /// Number of matched bytes
+    pub length: usize,
+}
+
+// How patterns are evaluated
+enum Engine {
+    // Short chains advanced together as bits of one word
+    ShiftAnd(ShiftAnd),
+    // All patterns folded into one automaton
+    Combined(Arc<Database>),
+    // Too many combined states; step every pattern on its own
+    PerPattern { depths: Vec<Vec<usize>> },
+}
+
+/// Compiled, immutable form of a pattern set.
+///
+/// A scanner holds no per-stream state, so one instance can be shared by any
+/// number of threads, each scanning with its own `ScanState`.
+pub struct Scanner {
+    patterns: Vec<Pattern>,
+    // Plain literals searched with memmem, as (pattern index, finder)
+    literals: Vec<(usize, Finder<'static>)>,
+    // Indices of the remaining patterns; the engine numbers them in this order
+    automaton: Vec<usize>,
+    engine: Engine,
+    // Selected once at construction so scans never re-detect features
+    automaton_kernel: ScanFn,
+    generation: u64,
+}
+
+/// Position of one logical stream within a `Scanner`
+#[derive(Debug, Clone, Default)]
+pub struct ScanState {
+    generation: Option<u64>,
+    state: u32,
+    active: u64,
+    // (engine pattern, state) pairs of partial matches in progress
+    active_states: Vec<(usize, usize)>,
+    offset: usize,
+    // Last bytes of the stream, for literal matches that start in one chunk
+    // and end in the next
+    tail: Vec<u8>,
+}
+
+impl ScanState {
+    /// A state for a new stream; it attaches to a scanner on first use
+    pub fn new() -> Self {
+        Self::default()
+    }
+
+    /// Number of bytes scanned so far; match positions are relative to this
+    pub fn offset(&self) -> usize {
+        self.offset
+    }
+}
+
+impl Scanner {
+    /// Compile `patterns`, preferring a single combined automaton.
+    ///
+    /// A handful of plain literals are searched with `memmem` instead, which
+    /// runs at close to memory bandwidth. If the other patterns are short
+    /// chains, they are matched bit-parallel without building an automaton.
+    /// If the combined automaton would be too large, the error is returned
+    /// alongside a scanner that steps each pattern separately.
+    pub fn compile(patterns: Vec<Pattern>) -> (Self, Option<Error>) {
+        let mut literals: Vec<(usize, Finder<'static>)> = patterns
+            .iter()
+            .enumerate()
+            .filter_map(|(index, pattern)| Some((index, Finder::new(&pattern.literal()?).into_owned())))
+            .collect();
+        if literals.len() > MAX_LITERALS {
+            literals.clear();
+        }
+
+        // Placeholders never match, so a set of only those skips scanning
+        let automaton: Vec<usize> = (0..patterns.len())
+            .filter(|index| !literals.iter().any(|(literal, _)| literal == index))
+            .filter(|&index| !patterns[index].never_matches())
+            .collect();
+        let automaton_patterns: Vec<Pattern> = automaton.iter().map(|&index| patterns[index].clone()).collect();
+
+        let (engine, error) = match ShiftAnd::compile(&automaton_patterns) {
+            Some(shift_and) => (Engine::ShiftAnd(shift_and), None),
+            None => match Database::compile_cached(&automaton_patterns) {
+                Ok(database) => (Engine::Combined(database), None),
+                Err(e) => {
+                    tracing::warn!("falling back to per-pattern matching: {}", e);
+                    let depths = automaton_patterns.iter().map(state_depths).collect();
+                    (Engine::PerPattern { depths }, Some(e))
+                }
+            },
+        };
+        let generation = NEXT_GENERATION.fetch_add(1, Ordering::Relaxed);
+
+        let automaton_kernel = select_automaton_kernel();
+
+        (Scanner { patterns, literals, automaton, engine, automaton_kernel, generation }, error)
+    }
+
+    /// Compile `patterns`, silently falling back to per-pattern matching
+    pub fn new(patterns: Vec<Pattern>) -> Self {
+        Self::compile(patterns).0
+    }
+
+    /// Number of patterns in the set
+    pub fn num_patterns(&self) -> usize {
+        self.patterns.len()
+    }
+
+    /// Identifier of the pattern at `pattern`, as reported in `Match::pattern`
+    pub fn pattern_id(&self, pattern: usize) -> &str {
+        &self.patterns[pattern].id
+    }
+
+    /// Approximate size of the compiled tables in bytes
+    pub fn memory_usage(&self) -> usize {
+        let literals: usize = self.literals.iter().map(|(_, finder)| finder.needle().len()).sum();
+        let engine = match &self.engine {
+            Engine::ShiftAnd(shift_and) => shift_and.memory_usage(),
+            Engine::Combined(database) => database.memory_usage(),
+            Engine::PerPattern { depths } => depths.iter().map(|d| d.len() * std::mem::size_of::<usize>()).sum(),
+        };
+        literals + engine
+    }
+
+    /// Scan the next chunk of the stream tracked by `scan_state`, appending
+    /// its matches to `matches` in the order they end.
+    ///
+    /// A state last used with a different scanner starts over from the
+    /// initial state, keeping its offset.
+    pub fn scan(&self, scan_state: &mut ScanState, data: &[u8], matches: &mut Vec<Match>) {
+        if scan_state.generation != Some(self.generation) {
+            scan_state.generation = Some(self.generation);
+            scan_state.state = Database::START;
+            scan_state.active = 0;
+            scan_state.active_states.clear();
+            scan_state.tail.clear();
+        }
+
+        let first = matches.len();
+        if !self.automaton.is_empty() {
+            // Kernels are only selected when the CPU supports them
+            unsafe { (self.automaton_kernel)(self, scan_state, data, matches) };
+        }
+        if !self.literals.is_empty() {
+            self.scan_literals(scan_state, data, matches);
+        }
+
+        // The automaton and every literal report in end order on their own,
+        // but one after the other; the check is cheap next to a sort
+        let found = &mut matches[first..];
+        if !found.is_sorted_by_key(|found| found.position + found.length) {
+            found.sort_by_key(|found| found.position + found.length);
+        }
+
+        scan_state.offset += data.len();
+    }
+
+    // Inlined into every kernel, so each gets compiled for its own CPU features
+    #[inline(always)]
+    fn scan_automaton(&self, scan_state: &mut ScanState, data: &[u8], matches: &mut Vec<Match>) {
+        let ScanState { state, active, active_states, offset, .. } = scan_state;
+        let base = *offset;
+
+        match &self.engine {
+            Engine::ShiftAnd(shift_and) => {
+                let mut i = 0;
+                while i < data.len() {
+                    if *active == 0 {
+                        // No pattern is partially matched until one of their
+                        // first bytes shows up
+                        if let Some(prefilter) = shift_and.prefilter() {
+                            match prefilter.find(&data[i..]) {
+                                Some(skip) => i += skip,
+                                None => break,
+                            }
+                        }
+                    }
+
+                    *active = shift_and.next_state(*active, data[i]);
+
+                    let mut finals = shift_and.finals(*active);
+                    while finals != 0 {
+                        let (pattern, length) = shift_and.end(finals.trailing_zeros());
+                        matches.push(Match {
+                            pattern: self.automaton[pattern as usize],
+                            position: base + i + 1 - length as usize,
+                            length: length as usize,
+                        });
+                        finals &= finals - 1;
+                    }
+                    i += 1;
+                }
+            }
+            Engine::Combined(database) => {
+                let mut i = 0;
+                while i < data.len() {
+                    if *state == Database::START {
+                        // Nothing can match until a pattern's first byte shows up
+                        if let Some(prefilter) = database.prefilter() {
+                            match prefilter.find(&data[i..]) {
+                                Some(skip) => i += skip,
+                                None => break,
+                            }
+                        }
+                    }
+
+                    *state = database.next_state(*state, data[i]);
+
+                    for &(pattern, length) in database.matches(*state) {
+                        matches.push(Match {
+                            pattern: self.automaton[pattern as usize],
+                            position: base + i + 1 - length as usize,
+                            length: length as usize,
+                        });
+                    }
+                    i += 1;
+                }
+            }
+            Engine::PerPattern { depths } => {
+                // Same semantics as the combined automaton, with the set of
+                // partial matches built as the input comes in
+                let mut next = Vec::new();
+                for (i, &byte) in data.iter().enumerate() {
+                    next.clear();
+                    let starts = self.automaton.iter().enumerate().map(|(engine_idx, &pattern_idx)| {
+                        (engine_idx, self.patterns[pattern_idx].initial_state)
+                    });
+                    for (engine_idx, state) in starts.chain(active_states.iter().copied()) {
+                        let pattern = &self.patterns[self.automaton[engine_idx]];
+                        if let Some(&next_state) = pattern.states[state].transitions.get(&byte) {
+                            next.push((engine_idx, next_state));
+                        }
+                    }
+                    next.sort_unstable();
+                    next.dedup();
+
+                    for &(engine_idx, state) in &next {
+                        let pattern_idx = self.automaton[engine_idx];
+                        if self.patterns[pattern_idx].states[state].is_final {
+                            let length = depths[engine_idx][state];
+                            matches.push(Match {
+                                pattern: pattern_idx,
+                                position: base + i + 1 - length,
+                                length,
+                            });
+                        }
+                    }
+                    std::mem::swap(active_states, &mut next);
+                }
+            }
+        }
+    }
+
+    // All occurrences of every literal, overlapping ones included like the
+    // other engines report them, and those that start in the tail of the
+    // previous chunk
+    fn scan_literals(&self, scan_state: &mut ScanState, data: &[u8], matches: &mut Vec<Match>) {
+        let ScanState { tail, offset, .. } = scan_state;
+        let base = *offset;
+        let keep = self.literals.iter().map(|(_, finder)| finder.needle().len()).max().unwrap_or(1) - 1;
+
+        // The tail is extended by the head of this chunk, so only matches
+        // crossing the boundary are new
+        let boundary = tail.len();
+        if boundary > 0 {
+            tail.extend_from_slice(&data[..data.len().min(keep)]);
+            for (pattern, finder) in &self.literals {
+                let length = finder.needle().len();
+                for start in find_overlapping(finder, tail) {
+                    if start < boundary && start + length > boundary {
+                        matches.push(Match { pattern: *pattern, position: base + start - boundary, length });
+                    }
+                }
+            }
+        }
+
+        for (pattern, finder) in &self.literals {
+            let length = finder.needle().len();
+            matches.extend(find_overlapping(finder, data).map(|start| Match { pattern: *pattern, position: base + start, length }));
+        }
+
+        if data.len() >= keep {
+            tail.clear();
+            tail.extend_from_slice(&data[data.len() - keep..]);
+        } else {
+            // Still holds the whole chunk from extending it above
+            if boundary == 0 {
+                tail.extend_from_slice(data);
+            }
+            let excess = tail.len().saturating_sub(keep);
+            tail.drain(..excess);
+        }
+    }
+}
+
+// Start of every occurrence of the finder's needle, resuming one byte after
+// each match; memmem's own iterator skips occurrences that overlap
+fn find_overlapping<'a>(finder: &'a Finder<'static>, haystack: &'a [u8]) -> impl Iterator<Item = usize> + 'a {
+    let mut start = 0;
+    std::iter::from_fn(move || {
+        let pos = start + finder.find(&haystack[start..])?;
+        start = pos + 1;
+        Some(pos)
+    })
+}
+
+// The automaton loops are plain scalar code; building them for newer CPUs
+// lets the compiler use BMI for the bit scans and wider registers where it
+// vectorizes, without giving up the portable baseline build
+fn select_automaton_kernel() -> ScanFn {
+    #[cfg(target_arch = "x86_64")]
+    {
+        if x86::has_v4() {
+            return x86::scan_automaton_v4;
+        }
+        if x86::has_v3() {
+            return x86::scan_automaton_v3;
+        }
+    }
+    scan_automaton_baseline
+}
+
+unsafe fn scan_automaton_baseline(scanner: &Scanner, scan_state: &mut ScanState, data: &[u8], matches: &mut Vec<Match>) {
+    scanner.scan_automaton(scan_state, data, matches)
+}
+
+#[cfg(target_arch = "x86_64")]
+mod x86 {
+    use super::{Match, ScanState, Scanner};
+
+    // x86-64-v3
+    pub(super) fn has_v3() -> bool {
+        is_x86_feature_detected!("avx2")
+            && is_x86_feature_detected!("bmi1")
+            && is_x86_feature_detected!("bmi2")
+            && is_x86_feature_detected!("lzcnt")
+            && is_x86_feature_detected!("popcnt")
+    }
+
+    // x86-64-v4
+    pub(super) fn has_v4() -> bool {
+        has_v3()
+            && is_x86_feature_detected!("avx512f")
+            && is_x86_feature_detected!("avx512bw")
+            && is_x86_feature_detected!("avx512vl")
+    }
+
+    #[target_feature(enable = "avx2,bmi1,bmi2,lzcnt,popcnt")]
+    pub(super) unsafe fn scan_automaton_v3(scanner: &Scanner, scan_state: &mut ScanState, data: &[u8], matches: &mut Vec<Match>) {
+        scanner.scan_automaton(scan_state, data, matches)
+    }
+
+    #[target_feature(enable = "avx2,bmi1,bmi2,lzcnt,popcnt,avx512f,avx512bw,avx512vl")]
+    pub(super) unsafe fn scan_automaton_v4(scanner: &Scanner, scan_state: &mut ScanState, data: &[u8], matches: &mut Vec<Match>) {
+        scanner.scan_automaton(scan_state, data, matches)
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::pattern::{PatternBuilder, compile_alternatives, compile_pattern};
+
+    #[test]
+    fn test_independent_states() {
+        let scanner = Scanner::new(vec![compile_pattern("needle").unwrap()]);
+        let mut first = ScanState::new();
+        let mut second = ScanState::new();
+        let mut matches = Vec::new();
+
+        scanner.scan(&mut first, b"hay nee", &mut matches);
+        scanner.scan(&mut second, b"dle", &mut matches);
+        assert!(matches.is_empty());
+
+        scanner.scan(&mut first, b"dle", &mut matches);
+        assert_eq!(matches, vec![Match { pattern: 0, position: 4, length: 6 }]);
+    }
+
+    #[test]
+    fn test_state_resets_for_new_scanner() {
+        let old = Scanner::new(vec![compile_pattern("needle").unwrap()]);
+        let new = Scanner::new(vec![compile_pattern("needle").unwrap(), compile_pattern("dle").unwrap()]);
+        let mut state = ScanState::new();
+        let mut matches = Vec::new();
+
+        old.scan(&mut state, b"nee", &mut matches);
+        new.scan(&mut state, b"dle", &mut matches);
+
+        assert_eq!(matches, vec![Match { pattern: 1, position: 3, length: 3 }]);
+        assert_eq!(state.offset(), 6);
+    }
+
+    // Same patterns on the per-pattern engine, which is otherwise only used
+    // for sets too large to combine
+    fn per_pattern_scanner(patterns: Vec<Pattern>) -> Scanner {
+        let depths = patterns.iter().map(state_depths).collect();
+        Scanner {
+            automaton: (0..patterns.len()).collect(),
+            patterns,
+            literals: Vec::new(),
+            engine: Engine::PerPattern { depths },
+            automaton_kernel: select_automaton_kernel(),
+            generation: NEXT_GENERATION.fetch_add(1, Ordering::Relaxed),
+        }
+    }
+
+    #[test]
+    fn test_engines_agree() {
+        let probes = ["ab", "aa", "aab"];
+        let fillers: Vec<String> = (0..6).map(|i| format!("zq{}", i)).collect();
+        let compile_all = |sources: &[&str]| sources.iter().map(|p| compile_pattern(p).unwrap()).collect::<Vec<_>>();
+
+        // Few literals use memmem, more than MAX_LITERALS short ones Shift-And,
+        // and more than 64 positions the combined automaton
+        let mut shift_and: Vec<&str> = probes.to_vec();
+        shift_and.extend(fillers.iter().map(String::as_str));
+        let long = "y".repeat(70);
+        let mut combined = shift_and.clone();
+        combined.push(&long);
+
+        let scanners = [
+            Scanner::new(compile_all(&probes)),
+            Scanner::new(compile_all(&shift_and)),
+            Scanner::new(compile_all(&combined)),
+            per_pattern_scanner(compile_all(&probes)),
+        ];
+        assert_eq!(scanners[0].literals.len(), probes.len());
+        assert!(matches!(scanners[1].engine, Engine::ShiftAnd(_)));
+        assert!(matches!(scanners[2].engine, Engine::Combined(_)));
+
+        for (data, expected) in [
+            (&b"aab"[..], vec![(0, 1), (1, 0), (2, 0)]),
+            (b"aaaa", vec![(1, 0), (1, 1), (1, 2)]),
+            (b"xaabaaab", vec![(1, 1), (1, 4), (1, 5), (2, 1), (2, 5), (0, 2), (0, 6)]),
+        ] {
+            let mut expected: Vec<(usize, usize)> = expected;
+            expected.sort_by_key(|&(pattern, position)| (position, pattern));
+
+            for scanner in &scanners {
+                // Byte by byte too, so partial matches carry across chunks
+                for chunk_size in [data.len(), 1] {
+                    let mut state = ScanState::new();
+                    let mut found = Vec::new();
+                    for chunk in data.chunks(chunk_size) {
+                        scanner.scan(&mut state, chunk, &mut found);
+                    }
+                    let mut found: Vec<(usize, usize)> = found
+                        .iter()
+                        .filter(|m| m.pattern < probes.len())
+                        .map(|m| (m.pattern, m.position))
+                        .collect();
+                    found.sort_by_key(|&(pattern, position)| (position, pattern));
+                    assert_eq!(found, expected);
+                }
+            }
+        }
+    }
+
+    #[test]
+    fn test_literals_overlap() {
+        let scanner = Scanner::new(vec![compile_pattern("aa").unwrap()]);
+        assert_eq!(scanner.literals.len(), 1);
+
+        let mut state = ScanState::new();
+        let mut matches = Vec::new();
+        scanner.scan(&mut state, b"aaa", &mut matches);
+        scanner.scan(&mut state, b"a", &mut matches);
+
+        assert_eq!(matches.iter().map(|m| m.position).collect::<Vec<_>>(), vec![0, 1, 2]);
+    }
+
+    #[test]
+    fn test_literals_in_end_order() {
+        let scanner = Scanner::new(vec![compile_pattern("test").unwrap(), compile_pattern("string").unwrap()]);
+        assert!(scanner.automaton.is_empty());
+
+        let mut state = ScanState::new();
+        let mut matches = Vec::new();
+        scanner.scan(&mut state, b"string te", &mut matches);
+        scanner.scan(&mut state, b"st string test", &mut matches);
+
+        let ends: Vec<_> = matches.iter().map(|m| m.position + m.length).collect();
+        assert_eq!(ends, vec![6, 11, 18, 23]);
+    }
+
+    #[test]
+    fn test_alternatives() {
+        let alternatives = compile_alternatives(&["ab".into(), "(?i)cd".into()], "either".into()).unwrap();
+        let scanner = Scanner::new(vec![alternatives, compile_pattern("b").unwrap()]);
+
+        let mut matches = Vec::new();
+        scanner.scan(&mut ScanState::new(), b"xabCD", &mut matches);
+        assert_eq!(
+            matches,
+            vec![
+                Match { pattern: 0, position: 1, length: 2 },
+                Match { pattern: 1, position: 2, length: 1 },
+                Match { pattern: 0, position: 3, length: 2 },
+            ]
+        );
+    }
+
+    #[test]
+    fn test_placeholders_are_not_scanned() {
+        let placeholder = PatternBuilder::new().build("elsewhere".into()).unwrap();
+        let scanner = Scanner::new(vec![placeholder, compile_pattern("x").unwrap()]);
+        assert!(scanner.automaton.is_empty());
+
+        let mut matches = Vec::new();
+        scanner.scan(&mut ScanState::new(), b"xx", &mut matches);
+        assert_eq!(matches.iter().map(|m| m.pattern).collect::<Vec<_>>(), vec![1, 1]);
+    }
+
+    #[test]
+    fn test_automaton_kernels_agree() {
+        let scanner = Scanner::new(vec![compile_pattern("(?i)union").unwrap(), compile_pattern("abc").unwrap()]);
+        let data = b"xx UNION abc union ab abc".repeat(100);
+
+        let run = |kernel: ScanFn| {
+            let mut matches = Vec::new();
+            unsafe { kernel(&scanner, &mut ScanState::new(), &data, &mut matches) };
+            matches
+        };
+        let expected = run(scan_automaton_baseline);
+        // "abc" is searched with memmem, outside the automaton
+        assert_eq!(expected.len(), 200);
+
+        #[cfg(target_arch = "x86_64")]
+        {
+            if x86::has_v3() {
+                assert_eq!(run(x86::scan_automaton_v3), expected);
+            }
+            if x86::has_v4() {
+                assert_eq!(run(x86::scan_automaton_v4), expected);
+            }
+        }
+    }
+
+    #[test]
+    fn test_literals_across_chunks() {
+        let mut builder = PatternBuilder::new();
+        let s1 = builder.add_state(false);
+        let s2 = builder.add_state(true);
+        builder
+            .add_transition(0, b'n', s1)
+            .add_transition(s1, b'e', s2)
+            .add_transition(s1, b'a', s2);
+        let branch = builder.build("branch".into()).unwrap();
+
+        let scanner = Scanner::new(vec![compile_pattern("needle").unwrap(), branch, compile_pattern("x").unwrap()]);
+        assert_eq!(scanner.literals.len(), 2);
+
+        let mut state = ScanState::new();
+        let mut matches = Vec::new();
+        for chunk in [&b"hay nee"[..], b"d", b"le x"] {
+            scanner.scan(&mut state, chunk, &mut matches);
+        }
+
+        assert_eq!(
+            matches,
+            vec![
+                Match { pattern: 1, position: 4, length: 2 },
+                Match { pattern: 0, position: 4, length: 6 },
+                Match { pattern: 2, position: 11, length: 1 },
+            ]
+        );
+    }
+}
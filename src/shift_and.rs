@@ -0,0 +1,132 @@
+use crate::pattern::Pattern;
+use crate::prefilter::Prefilter;
+
+/// Number of pattern positions that fit in the state word
+pub(crate) const MAX_POSITIONS: usize = u64::BITS as usize;
+
+// Bit-parallel (Shift-And) matcher for patterns that are plain chains.
+//
+// Every position of every pattern is one bit of a u64, with each pattern's
+// positions packed next to each other. A set bit means the input so far ends
+// with the pattern's prefix up to that position, so a byte advances all
+// patterns at once: shift every prefix one position on, start a new one at
+// every pattern, and keep only the positions that accept the byte. The
+// tables take 2 KiB however many patterns share them.
+#[derive(Debug, Clone)]
+pub(crate) struct ShiftAnd {
+    // Bit i of masks[byte] is set if position i accepts byte
+    masks: [u64; 256],
+    // First position of every pattern
+    starts: u64,
+    // Last position of every pattern
+    finals: u64,
+    // (pattern index, match length) for every final position, by bit
+    ends: Vec<(u32, u32)>,
+    // Finds the next byte that can start a pattern
+    prefilter: Option<Prefilter>,
+}
+
+impl ShiftAnd {
+    /// Build a matcher for `patterns`, or `None` if one of them is not a
+    /// chain or they need more than `MAX_POSITIONS` positions together
+    pub(crate) fn compile(patterns: &[Pattern]) -> Option<Self> {
+        let chains = patterns.iter().map(Pattern::chain).collect::<Option<Vec<_>>>()?;
+        if chains.is_empty() || chains.iter().map(Vec::len).sum::<usize>() > MAX_POSITIONS {
+            return None;
+        }
+
+        let mut masks = [0u64; 256];
+        let mut starts = 0;
+        let mut finals = 0;
+        let mut ends = vec![(0, 0); MAX_POSITIONS];
+        let mut bit = 0;
+
+        for (pattern, chain) in chains.iter().enumerate() {
+            starts |= 1 << bit;
+            for bytes in chain {
+                for &byte in bytes {
+                    masks[byte as usize] |= 1 << bit;
+                }
+                bit += 1;
+            }
+            finals |= 1 << (bit - 1);
+            ends[bit - 1] = (pattern as u32, chain.len() as u32);
+        }
+
+        let prefilter = Prefilter::new(chains.iter().flat_map(|chain| chain[0].iter().copied()));
+
+        Some(ShiftAnd { masks, starts, finals, ends, prefilter })
+    }
+
+    #[inline]
+    pub(crate) fn next_state(&self, active: u64, byte: u8) -> u64 {
+        // A pattern's last bit shifts into the next pattern's first, which
+        // `starts` sets anyway
+        ((active << 1) | self.starts) & self.masks[byte as usize]
+    }
+
+    /// Positions of `active` at which a pattern ends
+    #[inline]
+    pub(crate) fn finals(&self, active: u64) -> u64 {
+        active & self.finals
+    }
+
+    /// Pattern index and match length of the pattern ending at `bit`
+    #[inline]
+    pub(crate) fn end(&self, bit: u32) -> (u32, u32) {
+        self.ends[bit as usize]
+    }
+
+    #[inline]
+    pub(crate) fn prefilter(&self) -> Option<&Prefilter> {
+        self.prefilter.as_ref()
+    }
+
+    pub(crate) fn memory_usage(&self) -> usize {
+        std::mem::size_of_val(&self.masks) + std::mem::size_of_val(self.ends.as_slice())
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::pattern::{PatternBuilder, compile_pattern};
+
+    fn scan(shift_and: &ShiftAnd, data: &[u8]) -> Vec<(u32, usize)> {
+        let mut active = 0;
+        let mut found = Vec::new();
+        for (i, &byte) in data.iter().enumerate() {
+            active = shift_and.next_state(active, byte);
+            let mut finals = shift_and.finals(active);
+            while finals != 0 {
+                let (pattern, length) = shift_and.end(finals.trailing_zeros());
+                found.push((pattern, i + 1 - length as usize));
+                finals &= finals - 1;
+            }
+        }
+        found
+    }
+
+    #[test]
+    fn test_overlapping_matches() {
+        let patterns = vec![
+            compile_pattern("aab").unwrap(),
+            compile_pattern("(?i)ab").unwrap(),
+        ];
+        let shift_and = ShiftAnd::compile(&patterns).unwrap();
+
+        assert_eq!(scan(&shift_and, b"aaab xAB"), vec![(0, 1), (1, 2), (1, 6)]);
+    }
+
+    #[test]
+    fn test_rejects_non_chains() {
+        let mut builder = PatternBuilder::new();
+        let s1 = builder.add_state(true);
+        builder.add_transition(0, b'a', s1).add_transition(s1, b'a', s1);
+        let looping = builder.build("loop".into()).unwrap();
+
+        assert!(ShiftAnd::compile(&[looping]).is_none());
+        assert!(ShiftAnd::compile(&[compile_pattern(&"x".repeat(MAX_POSITIONS + 1)).unwrap()]).is_none());
+        assert!(ShiftAnd::compile(&[]).is_none());
+    }
+}